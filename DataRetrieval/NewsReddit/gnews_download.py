@@ -147,7 +147,7 @@ def compress_and_upload():
             # Remove all duplicate lines, pipe to zst in s3 path
             os.system(f"awk '!seen[$0]++' {path} | zstd -o {file_path}")
 
-    upload_all("raw/news/gnews")
+    upload_all("raw/news/gnews/")
 
 
 
@@ -155,23 +155,20 @@ func TagText(text, startTicker string, mapping SearchTermNode) []TaggedText {
 	return output
 }
 
-// Read parquet, split articles, maintain file pointers
-func SplitNewsParquet(path, gnewsPath string, mapping SearchTermNode) error {
+// Read parquet, split articles, write to the ticker csvs (writers are left open for the caller to close)
+func SplitNewsParquet(path, gnewsPath string, mapping SearchTermNode, writers *ArtifactWriters) (SplitStats, error) {
+	stats := SplitStats{}
 	fr, err := local.NewLocalFileReader(path)
 	if err != nil {
-		return fmt.Errorf("error opening file: %v", err)
+		return stats, fmt.Errorf("error opening file: %v", err)
 	}
 	defer fr.Close()
 	pr, err := reader.NewParquetReader(fr, new(NewsArticle), 4)
 	if err != nil {
-		return fmt.Errorf("error creating parquet reader: %v", err)
+		return stats, fmt.Errorf("error creating parquet reader: %v", err)
 	}
 	defer pr.ReadStop()
 
-	// File map
-	files := map[string]*os.File{}
-	csvWriters := map[string]*csv.Writer{}
-
 	numRows := int(pr.GetNumRows())
 	batchSize := 1000
 	articles := make([]NewsArticle, batchSize)
@@ -180,6 +177,7 @@ func SplitNewsParquet(path, gnewsPath string, mapping SearchTermNode) error {
 			log.Printf("Error reading row %d: %v", i, err)
 			continue
 		}
+		stats.Rows += len(articles)
 		for _, article := range articles {
 			// Convert timestamp to readable time
 			// timestamp := time.Unix(0, article.DateTime*int64(time.Millisecond))
@@ -188,16 +186,10 @@ func SplitNewsParquet(path, gnewsPath string, mapping SearchTermNode) error {
 				if t.Ticker == "" {
 					continue
 				}
-				if _, ok := csvWriters[t.Ticker]; !ok {
-					// Add artifact writer
-					f, err := os.OpenFile(gnewsPath+t.Ticker+".csv", os.O_APPEND|os.O_WRONLY|os.O_CREATE, 0600)
-					if err != nil {
-						panic(err)
-					}
-					files[t.Ticker] = f
-					csvWriters[t.Ticker] = csv.NewWriter(f)
+				writer, err := writers.Get(gnewsPath + t.Ticker + ".csv")
+				if err != nil {
+					return stats, err
 				}
-				writer := csvWriters[t.Ticker]
 
 				writer.Write([]string{
 					article.Url,
@@ -206,13 +198,9 @@ func SplitNewsParquet(path, gnewsPath string, mapping SearchTermNode) error {
 					article.Domain,
 					strconv.FormatInt(article.DateTime, 10),
 				})
+				stats.Segments++
 			}
 		}
 	}
-
-	for ticker, file := range files {
-		csvWriters[ticker].Flush()
-		file.Close()
-	}
-	return nil
+	return stats, nil
 }
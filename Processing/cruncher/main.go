@@ -30,9 +30,15 @@ Cruncher tool for Reddit and News article processing.
       Splits a Reddit Parquet file into multiple Parquet files by matched search terms.
           ./cruncher split-reddit input.parquet output_folder/
 
+  6. split-batch:
+      Splits every input in a JSONL manifest in one process, keeping the search terms and ticker files open
+      between inputs. Prints a JSON line of row counts per input to stdout (see split_batch.go).
+          ./cruncher split-batch manifest.jsonl
+
 Notes:
 - The splitter commands use a predefined search term mapping from:
 	DataRetrieval/Stocks/data/search_terms_reduced.csv
+  found relative to the cruncher directory, or set CRUNCHER_SEARCH_TERMS to use another file.
 */
 
 
@@ -88,20 +94,35 @@ func main() {
 			panic("error processing news articles: " + err.Error())
 		}
 
-	} else if cmd == "split-news" {
-		// Next arg is input file, followed by path (including trailing slash) of output
-		parquetPath := os.Args[2]
-		outputPath := os.Args[3]
-		mapping := BuildSearchTermMapping("../../DataRetrieval/Stocks/data/search_terms_reduced.csv")
-		SplitNewsParquet(parquetPath, outputPath, mapping)
-	} else if cmd == "split-reddit" {
+	} else if cmd == "split-news" || cmd == "split-reddit" {
 		// Next arg is input file, followed by path (including trailing slash) of output
 		parquetPath := os.Args[2]
 		outputPath := os.Args[3]
-		mapping := BuildSearchTermMapping("../../DataRetrieval/Stocks/data/search_terms_reduced.csv")
-		SplitRedditParquet(parquetPath, outputPath, mapping)
+		mapping := BuildSearchTermMapping(SearchTermsPath())
+		writers := NewArtifactWriters()
+		var err error
+		if cmd == "split-news" {
+			_, err = SplitNewsParquet(parquetPath, outputPath, mapping, writers)
+		} else {
+			_, err = SplitRedditParquet(parquetPath, outputPath, mapping, writers)
+		}
+		if closeErr := writers.Close(); err == nil {
+			err = closeErr
+		}
+		if err != nil {
+			panic("error splitting " + parquetPath + ": " + err.Error())
+		}
+	} else if cmd == "split-batch" {
+		// Next arg is the JSONL manifest of inputs
+		failed, err := SplitBatch(os.Args[2])
+		if err != nil {
+			panic("error splitting batch: " + err.Error())
+		}
+		if failed > 0 {
+			os.Exit(1)
+		}
 	} else {
-		panic("invalid command: " + cmd + ", expected reddit-submissions, reddit-comments, or news-articles")
+		panic("invalid command: " + cmd + ", expected reddit-submissions, reddit-comments, news-articles, split-news, split-reddit or split-batch")
 	}
 
 }
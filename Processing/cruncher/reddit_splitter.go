@@ -1,10 +1,8 @@
 package main
 
 import (
-	"encoding/csv"
 	"fmt"
 	"log"
-	"os"
 	"sort"
 	"strconv"
 	"strings"
@@ -21,18 +19,19 @@ We read one file at a time and stream to ~500 ticker files (mapped by the reduce
 */
 
 
-// Read parquet, split articles, maintain file pointers
-func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNode) error {
+// Read parquet, split posts then comments, write to the ticker csvs (writers are left open for the caller to close)
+func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNode, writers *ArtifactWriters) (SplitStats, error) {
+	stats := SplitStats{}
 	commentsPath := strings.Replace(submissionsPath, "submissions", "comments", 1)
 	outputCommentsPath := strings.Replace(outputPath, "submissions", "comments", 1)
 	// Start with submissions, build map of post_id -> ticker, then do comments
 	fr, err := local.NewLocalFileReader(submissionsPath)
 	if err != nil {
-		return fmt.Errorf("error opening file: %v", err)
+		return stats, fmt.Errorf("error opening file: %v", err)
 	}
 	pr, err := reader.NewParquetReader(fr, new(RedditSubmission), 4)
 	if err != nil {
-		return fmt.Errorf("error creating parquet reader: %v", err)
+		return stats, fmt.Errorf("error creating parquet reader: %v", err)
 	}
 
 	// Map of reddit_id -> ticker
@@ -40,10 +39,6 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 	mapToTicker := map[string]string{}
 	allPosts := map[string]RedditSubmission{}
 
-	// File map
-	files := map[string]*os.File{}
-	csvWriters := map[string]*csv.Writer{}
-
 	numRows := int(pr.GetNumRows())
 	batchSize := 1000
 	posts := make([]RedditSubmission, batchSize)
@@ -52,6 +47,7 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 			log.Printf("Error reading row %d: %v", i, err)
 			continue
 		}
+		stats.Rows += len(posts)
 		for _, post := range posts {
 			allPosts[post.PostId] = post
 
@@ -64,16 +60,10 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 					continue
 				}
 
-				if _, ok := csvWriters[t.Ticker]; !ok {
-					// Add artifact writer
-					f, err := os.OpenFile(outputPath+t.Ticker+".csv", os.O_APPEND|os.O_WRONLY|os.O_CREATE, 0600)
-					if err != nil {
-						panic(err)
-					}
-					files[t.Ticker] = f
-					csvWriters[t.Ticker] = csv.NewWriter(f)
+				writer, err := writers.Get(outputPath + t.Ticker + ".csv")
+				if err != nil {
+					return stats, err
 				}
-				writer := csvWriters[t.Ticker]
 
 				// Columns: post_id,text,domain,flair,subreddit,score,downs,datetime
 				writer.Write([]string{
@@ -88,6 +78,8 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 					strconv.FormatInt(post.Datetime, 10),
 				})
 
+				stats.Segments++
+
 				// Update ticker region size
 				tickerRegionSize[t.Ticker] += len(t.Text)
 			}
@@ -105,27 +97,19 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 		}
 	}
 
-	for ticker, file := range files {
-		csvWriters[ticker].Flush()
-		file.Close()
-	}
 	fr.Close()
 	pr.ReadStop()
 
-	// New files and writers
-	files = map[string]*os.File{}
-	csvWriters = map[string]*csv.Writer{}
-
 	// Now comments, we need to sort by datetime and construct a map of comment_id -> ticker to ensure
 	// child comments can see ticker of parent comment
 	fr, err = local.NewLocalFileReader(commentsPath)
 	if err != nil {
-		return fmt.Errorf("error opening file: %v", err)
+		return stats, fmt.Errorf("error opening file: %v", err)
 	}
 
 	pr, err = reader.NewParquetReader(fr, new(RedditComment), 4)
 	if err != nil {
-		return fmt.Errorf("error creating parquet reader: %v", err)
+		return stats, fmt.Errorf("error creating parquet reader: %v", err)
 	}
 
 	// Comments need to be sorted by datetime ascending
@@ -143,6 +127,7 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 
 	// Sort comments by datetime
 	log.Println("sorting", len(comments), "comments")
+	stats.Rows += len(comments)
 	sort.Slice(comments, func(i, j int) bool {
 		return comments[i].Datetime < comments[j].Datetime
 	})
@@ -166,16 +151,10 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 				continue
 			}
 
-			if _, ok := csvWriters[t.Ticker]; !ok {
-				// Add artifact writer
-				f, err := os.OpenFile(outputCommentsPath+t.Ticker+".csv", os.O_APPEND|os.O_WRONLY|os.O_CREATE, 0600)
-				if err != nil {
-					panic(err)
-				}
-				files[t.Ticker] = f
-				csvWriters[t.Ticker] = csv.NewWriter(f)
+			writer, err := writers.Get(outputCommentsPath + t.Ticker + ".csv")
+			if err != nil {
+				return stats, err
 			}
-			writer := csvWriters[t.Ticker]
 
 			// Columns: comment_id,text,score,datetime,parent_id,start_ticker,post_id,flair,subreddit,post_score,post_downs,post_datetime
 			writer.Write([]string{
@@ -195,6 +174,8 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 				strconv.FormatInt(post.Datetime, 10),
 			})
 
+			stats.Segments++
+
 			// Update ticker region size
 			tickerRegionSize[t.Ticker] += len(t.Text)
 		}
@@ -211,12 +192,8 @@ func SplitRedditParquet(submissionsPath, outputPath string, mapping SearchTermNo
 		mapToTicker[comment.Id] = maxTicker
 	}
 	log.Println(matches, "matches of", len(comments), " comments")
-	for ticker, file := range files {
-		csvWriters[ticker].Flush()
-		file.Close()
-	}
 	fr.Close()
 	pr.ReadStop()
 
-	return nil
+	return stats, nil
 }
@@ -0,0 +1,182 @@
+package main
+
+import (
+	"bufio"
+	"encoding/csv"
+	"encoding/json"
+	"fmt"
+	"os"
+	"path/filepath"
+	"time"
+)
+
+/*
+
+Batch mode for the splitters: one long-lived process works through a manifest of input files, so the search
+term trie is built once and the per-ticker csv writers stay open across files instead of being reopened for
+every input.
+
+The manifest is JSONL, one input per line:
+	{"mode": "news", "input": "gnews/Accenture.parquet", "output": "gnews_artifacts/"}
+	{"mode": "reddit", "input": "submissions/wallstreetbets.parquet", "output": "submissions_artifacts/"}
+
+After each input, its rows are flushed to the csvs and one JSON line is printed to stdout:
+	{"input": "gnews/Accenture.parquet", "rows": 5000, "segments": 7212, "seconds": 1.3}
+with "error" set if the input couldn't be split. Logging goes to stderr so stdout stays machine readable.
+
+*/
+
+// Relative to the cruncher directory, used unless CRUNCHER_SEARCH_TERMS is set
+const DefaultSearchTermsPath = "../../DataRetrieval/Stocks/data/search_terms_reduced.csv"
+
+// Find the search term csv regardless of the working directory cruncher is run from
+func SearchTermsPath() string {
+	if path := os.Getenv("CRUNCHER_SEARCH_TERMS"); path != "" {
+		return path
+	}
+	if _, err := os.Stat(DefaultSearchTermsPath); err == nil {
+		return DefaultSearchTermsPath
+	}
+	executable, err := os.Executable()
+	if err != nil {
+		return DefaultSearchTermsPath
+	}
+	return filepath.Join(filepath.Dir(executable), DefaultSearchTermsPath)
+}
+
+// Rows read from an input and ticker segments written for it
+type SplitStats struct {
+	Rows, Segments int
+}
+
+// Per-ticker csv writers, keyed by output path and opened in append mode on first use
+// Go raises the open file soft limit to the hard limit on startup, so ~1000 open artifacts is fine
+type ArtifactWriters struct {
+	files   map[string]*os.File
+	writers map[string]*csv.Writer
+}
+
+func NewArtifactWriters() *ArtifactWriters {
+	return &ArtifactWriters{
+		files:   map[string]*os.File{},
+		writers: map[string]*csv.Writer{},
+	}
+}
+
+func (a *ArtifactWriters) Get(path string) (*csv.Writer, error) {
+	if writer, ok := a.writers[path]; ok {
+		return writer, nil
+	}
+	f, err := os.OpenFile(path, os.O_APPEND|os.O_WRONLY|os.O_CREATE, 0600)
+	if err != nil {
+		return nil, err
+	}
+	a.files[path] = f
+	a.writers[path] = csv.NewWriter(f)
+	return a.writers[path], nil
+}
+
+// Write buffered rows through to the files
+func (a *ArtifactWriters) Flush() error {
+	for path, writer := range a.writers {
+		writer.Flush()
+		if err := writer.Error(); err != nil {
+			return fmt.Errorf("error writing %s: %v", path, err)
+		}
+	}
+	return nil
+}
+
+func (a *ArtifactWriters) Close() error {
+	err := a.Flush()
+	for _, f := range a.files {
+		if closeErr := f.Close(); closeErr != nil && err == nil {
+			err = closeErr
+		}
+	}
+	a.files = map[string]*os.File{}
+	a.writers = map[string]*csv.Writer{}
+	return err
+}
+
+type BatchInput struct {
+	Mode   string `json:"mode"`
+	Input  string `json:"input"`
+	Output string `json:"output"`
+}
+
+type BatchResult struct {
+	Input    string  `json:"input"`
+	Rows     int     `json:"rows"`
+	Segments int     `json:"segments"`
+	Seconds  float64 `json:"seconds"`
+	Error    string  `json:"error,omitempty"`
+}
+
+// Read every entry of a JSONL manifest up front, so a bad line fails before anything is split
+func ReadBatchManifest(path string) ([]BatchInput, error) {
+	f, err := os.Open(path)
+	if err != nil {
+		return nil, fmt.Errorf("error opening manifest: %v", err)
+	}
+	defer f.Close()
+
+	inputs := []BatchInput{}
+	scanner := bufio.NewScanner(f)
+	for line := 1; scanner.Scan(); line++ {
+		if len(scanner.Bytes()) == 0 {
+			continue
+		}
+		var input BatchInput
+		if err := json.Unmarshal(scanner.Bytes(), &input); err != nil {
+			return nil, fmt.Errorf("manifest line %d: %v", line, err)
+		}
+		if input.Mode != "news" && input.Mode != "reddit" {
+			return nil, fmt.Errorf("manifest line %d: invalid mode %q, expected news or reddit", line, input.Mode)
+		}
+		inputs = append(inputs, input)
+	}
+	return inputs, scanner.Err()
+}
+
+// Split every input in the manifest with one trie and one set of writers, reporting each file on stdout
+// Returns the number of inputs that failed
+func SplitBatch(manifestPath string) (int, error) {
+	inputs, err := ReadBatchManifest(manifestPath)
+	if err != nil {
+		return 0, err
+	}
+	mapping := BuildSearchTermMapping(SearchTermsPath())
+	writers := NewArtifactWriters()
+	defer writers.Close()
+	progress := json.NewEncoder(os.Stdout)
+
+	failed := 0
+	for _, input := range inputs {
+		start := time.Now()
+		var stats SplitStats
+		if input.Mode == "news" {
+			stats, err = SplitNewsParquet(input.Input, input.Output, mapping, writers)
+		} else {
+			stats, err = SplitRedditParquet(input.Input, input.Output, mapping, writers)
+		}
+		if err == nil {
+			err = writers.Flush()
+		}
+
+		result := BatchResult{
+			Input:    input.Input,
+			Rows:     stats.Rows,
+			Segments: stats.Segments,
+			Seconds:  time.Since(start).Seconds(),
+		}
+		if err != nil {
+			result.Error = err.Error()
+			failed++
+		}
+		if err := progress.Encode(result); err != nil {
+			return failed, err
+		}
+	}
+	return failed, writers.Close()
+}
@@ -2,6 +2,8 @@ package main
 
 import (
 	"log"
+	"os"
+	"path/filepath"
 	"testing"
 )
 
@@ -29,3 +31,28 @@ The company has a stable business model and they are very profitable in the US.
 
 	log.Println(TagText(text, "", mapping))
 }
+
+func TestReadBatchManifest(t *testing.T) {
+	path := filepath.Join(t.TempDir(), "manifest.jsonl")
+	manifest := `{"mode": "news", "input": "a.parquet", "output": "gnews_artifacts/"}
+
+{"mode": "reddit", "input": "submissions/b.parquet", "output": "submissions_artifacts/"}
+`
+	if err := os.WriteFile(path, []byte(manifest), 0600); err != nil {
+		t.Fatal(err)
+	}
+	inputs, err := ReadBatchManifest(path)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if len(inputs) != 2 || inputs[0].Mode != "news" || inputs[1].Input != "submissions/b.parquet" {
+		t.Fatalf("unexpected manifest entries: %v", inputs)
+	}
+
+	if err := os.WriteFile(path, []byte(`{"mode": "tweets", "input": "c.parquet"}`), 0600); err != nil {
+		t.Fatal(err)
+	}
+	if _, err := ReadBatchManifest(path); err == nil {
+		t.Fatal("expected an error for an invalid mode")
+	}
+}
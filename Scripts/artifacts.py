@@ -0,0 +1,235 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+import subprocess
+import tempfile
+from botocore.exceptions import ClientError
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from tqdm import tqdm
+from s3 import *
+from crunch import CRUNCHER_PATH
+
+"""
+Helpers shared by split_news.py and split_reddit.py for building per-ticker artifacts.
+
+All inputs are split by a single `cruncher split-batch` process, which keeps its search terms and ticker csvs
+open between inputs and reports rows per input as it goes.
+
+Splitting is incremental: a ledger in S3 records which processed inputs (and which version of them, by ETag)
+have already been split. Only new or changed inputs are run through the cruncher, and their rows are merged
+into the existing ticker parquets, so only tickers that appear in the new inputs are rewritten and re-uploaded.
+
+A full rebuild rewrites every ticker with rows from scratch, and deletes the artifacts of tickers that no longer
+get any (remove_stale_artifacts) so none are left over from the previous split.
+
+Conversion streams each csv (and existing parquet) through in record batches with an explicit schema, dropping
+duplicate rows by a 64-bit hash of the row, so memory is bounded by the batch size plus 8 bytes per unique row
+rather than by the size of the ticker. Tickers are converted in parallel, largest first.
+"""
+
+# Bytes of csv per streamed batch, roughly bounds memory per worker
+CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+
+# {input s3 path: version} of everything already split, empty if there's no ledger yet
+# Any other error (permissions, throttling, 5xx) is raised, rather than starting over and overwriting the ledger
+def load_ledger(ledger_path):
+    try:
+        download(ledger_path, overwrite=True)
+    except ClientError as e:
+        if error_code(e) not in ("404", "NoSuchKey", "NotFound"):
+            raise
+        return {}
+    with open(s3_to_local_path(ledger_path)) as f:
+        return json.load(f)
+
+
+def save_ledger(ledger_path, ledger):
+    local_path = s3_to_local_path(ledger_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(local_path, "w") as f:
+        json.dump(ledger, f, indent=1, sort_keys=True)
+    upload(ledger_path)
+
+
+# Inputs whose current version hasn't been split yet
+def pending_inputs(versions, ledger):
+    return sorted(path for path, version in versions.items() if ledger.get(path) != version)
+
+
+# Remove interim csvs left behind by a previous (possibly failed) run
+def clear_csvs(local_dir):
+    for path in Path(local_dir).glob("*.csv"):
+        os.remove(path)
+
+
+# Split inputs [(mode, local input path, local output dir)] with one cruncher process, mode is news or reddit
+# Returns the cruncher's result for each input, raises if any failed
+def split_batch(inputs):
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as manifest:
+        for mode, input_path, output_dir in inputs:
+            manifest.write(json.dumps({"mode": mode, "input": str(input_path), "output": f"{output_dir}{os.sep}"}) + "\n")
+
+    results = []
+    try:
+        # Progress comes back on stdout as a JSON line per input, logging stays on stderr
+        cruncher = subprocess.Popen([CRUNCHER_PATH, "split-batch", manifest.name], stdout=subprocess.PIPE, text=True)
+        for line in tqdm(cruncher.stdout, total=len(inputs)):
+            result = json.loads(line)
+            results.append(result)
+            name = Path(result["input"]).name
+            if result.get("error"):
+                tqdm.write(f"{name}: {result['error']}")
+            else:
+                tqdm.write(f"{name}: {result['rows']} rows, {result['segments']} segments in {result['seconds']:.1f}s")
+        cruncher.wait()
+    finally:
+        os.remove(manifest.name)
+
+    failed = [result["input"] for result in results if result.get("error")]
+    if failed or cruncher.returncode != 0 or len(results) != len(inputs):
+        raise Exception(f"Error splitting {', '.join(failed) or 'batch'} (cruncher exited with {cruncher.returncode}), nothing has been merged or recorded as split")
+    return results
+
+
+# Hash of a null value, distinct from any value's hash in practice
+NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+# 64-bit hash of every value in an Arrow column, after casting it to a fixed type (int64, float64 or string)
+# Hashing the Arrow values directly keeps a row's hash the same whatever else is in its batch, whereas
+# pandas turns an int column with a null into floats
+def hash_column(column):
+    if pa.types.is_integer(column.type) or pa.types.is_boolean(column.type):
+        column, fill = pc.cast(column, pa.int64()), 0
+    elif pa.types.is_floating(column.type):
+        column, fill = pc.cast(column, pa.float64()), 0.0
+    else:
+        column, fill = pc.cast(column, pa.string()), ""
+    values = pc.fill_null(column, fill).to_numpy(zero_copy_only=False)
+    hashes = pd.util.hash_array(values, categorize=False)
+    hashes[column.is_null().to_numpy(zero_copy_only=False)] = NULL_HASH
+    return hashes
+
+
+# Combined hash of each row of a record batch
+def hash_rows(batch):
+    hashes = np.zeros(batch.num_rows, dtype=np.uint64)
+    for column in batch.columns:
+        hashes = hashes * np.uint64(1_000_003) ^ hash_column(column)
+    return hashes
+
+
+# Drops rows already seen (in this batch or earlier ones) by hashing every column
+# Seen hashes are kept as sorted runs, each at least twice the length of the next. A batch's new hashes
+# become a run, merged into the previous one while that's no longer than it, so each hash is merged
+# O(log rows) times and there are only O(log rows) runs to binary search, at 8 bytes per hash
+class Deduper:
+    def __init__(self):
+        self.runs = []
+
+    # Which of the (sorted) hashes are in a run, sorted queries keep the binary searches cache friendly
+    def seen(self, hashes):
+        seen = np.zeros(len(hashes), dtype=bool)
+        for run in self.runs:
+            positions = np.minimum(np.searchsorted(run, hashes), len(run) - 1)
+            seen |= run[positions] == hashes
+        return seen
+
+    # Add sorted hashes that aren't in any run yet
+    def add(self, run):
+        while self.runs and len(self.runs[-1]) <= len(run):
+            # Stable sort spots the two sorted halves and merges them in linear time
+            run = np.sort(np.concatenate([self.runs.pop(), run]), kind="stable")
+        self.runs.append(run)
+
+    def __call__(self, batch):
+        hashes, first = np.unique(hash_rows(batch), return_index=True)
+        new = ~self.seen(hashes)
+        if new.any():
+            self.add(hashes[new])
+        keep = np.zeros(batch.num_rows, dtype=bool)
+        keep[first[new]] = True
+        return batch.filter(pa.array(keep))
+
+
+# Stream existing parquet rows (if merging) then csv rows into a new deduplicated parquet
+# Runs in a worker process, returns the number of rows written
+def convert_artifact(csv_path, parquet_path, schema, merge=True):
+    csv_path, parquet_path = Path(csv_path), Path(parquet_path)
+    tmp_path = parquet_path.with_name(parquet_path.name + ".tmp")
+    dedupe = Deduper()
+    rows = 0
+
+    def batches():
+        if merge and parquet_path.exists():
+            for batch in pq.ParquetFile(parquet_path).iter_batches(columns=schema.names):
+                yield pa.RecordBatch.from_arrays([batch.column(name).cast(field.type) for name, field in zip(schema.names, schema)], schema=schema)
+        reader = pv.open_csv(
+            csv_path,
+            read_options=pv.ReadOptions(column_names=schema.names, block_size=CSV_BLOCK_SIZE),
+            # Text fields are quoted and can contain newlines, which may fall across a block boundary
+            parse_options=pv.ParseOptions(newlines_in_values=True),
+            convert_options=pv.ConvertOptions(column_types=schema, strings_can_be_null=True),
+        )
+        yield from reader
+
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for batch in batches():
+            batch = dedupe(batch)
+            if batch.num_rows:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+
+    os.replace(tmp_path, parquet_path)
+    os.remove(csv_path)
+    return rows
+
+
+# Convert the ticker csvs the cruncher wrote into parquet, merging with the existing artifact for that ticker
+# Only touched tickers are downloaded, deduplicated and rewritten. Returns the s3 paths of the parquets written.
+def merge_artifacts(artifacts_prefix, schema, merge=True, workers=None):
+    local_dir = s3_to_local_path(artifacts_prefix)
+    csv_paths = sorted(local_dir.glob("*.csv"), key=lambda path: path.stat().st_size, reverse=True)
+    parquet_paths = [local_to_s3_path(path.with_suffix(".parquet")) for path in csv_paths]
+
+    # Fetch the current version of every touched artifact that already exists
+    if merge and parquet_paths:
+        remote = refresh_manifest(artifacts_prefix)
+        transfer_all(download, [path for path in parquet_paths if path in remote], overwrite=True)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+            pool.submit(convert_artifact, csv_path, s3_to_local_path(parquet_path), schema, merge)
+            for csv_path, parquet_path in zip(csv_paths, parquet_paths)
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            future.result()
+    return parquet_paths
+
+
+# After a full rebuild, delete the artifacts under a prefix (locally and in S3) that weren't rewritten
+# Call once the rewritten ones are uploaded, so there's never a moment with neither version in S3
+def remove_stale_artifacts(artifacts_prefix, rewritten):
+    rewritten = set(rewritten)
+    stale = sorted(path for path in refresh_manifest(artifacts_prefix) if path.endswith(".parquet") and path not in rewritten)
+    stale_local = [path for path in s3_to_local_path(artifacts_prefix).glob("*.parquet") if local_to_s3_path(path) not in rewritten]
+
+    # delete_objects takes up to 1000 keys a request
+    for start in range(0, len(stale), 1000):
+        response = with_retries(s3.delete_objects, Bucket=BUCKET, Delete={"Objects": [{"Key": path} for path in stale[start:start + 1000]]})
+        if response.get("Errors"):
+            raise Exception(f"Error deleting stale artifacts, e.g. {response['Errors'][0]}")
+    for path in stale_local:
+        path.unlink(missing_ok=True)
+
+    # The saved manifest still lists the deleted artifacts
+    if stale:
+        refresh_manifest(artifacts_prefix)
+    print(f"Removed {len(stale)} stale artifacts from S3 and {len(stale_local)} locally under {artifacts_prefix}")
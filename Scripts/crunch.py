@@ -0,0 +1,95 @@
+import os
+import subprocess
+import tempfile
+import time
+import psutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+"""
+Run `zstdcat <input> | cruncher <mode> <output>` pipelines in parallel.
+Used by process_reddit.py and process_news.py, must be invoked from group-project dir.
+
+Each pipeline is a pair of subprocesses, so a thread per pipeline is enough to keep them all busy.
+Jobs are started largest input first so one huge file doesn't end up running alone at the end.
+Output is written to <output>.tmp and only renamed into place if both zstdcat and cruncher exit cleanly,
+so a failed run never leaves behind a parquet file that later runs would skip.
+"""
+
+CRUNCHER_PATH = "./Processing/cruncher/cruncher"
+# Reddit dumps are compressed with a 2GB window, which zstd refuses to decompress by default
+ZSTDCAT = ["zstdcat", "--long=31"]
+# Rough peak memory of one pipeline (2GB zstd window + cruncher parquet buffers)
+PIPELINE_MEMORY = 3 * 1024 ** 3
+# zstdcat and cruncher each keep about a core busy
+PIPELINE_CORES = 2
+
+
+# As many pipelines as the machine has cores and free memory for
+def default_workers():
+    by_cores = (os.cpu_count() or 1) // PIPELINE_CORES
+    by_memory = psutil.virtual_memory().available // PIPELINE_MEMORY
+    return int(max(1, min(by_cores, by_memory)))
+
+
+# Run a single pipeline, raising if either side of the pipe fails
+# Returns the number of seconds taken
+def crunch(input_path, mode, output_path):
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    start = time.time()
+    with tempfile.TemporaryFile() as zstdcat_err:
+        zstdcat = subprocess.Popen(ZSTDCAT + [str(input_path)], stdout=subprocess.PIPE, stderr=zstdcat_err)
+        cruncher = subprocess.Popen([CRUNCHER_PATH, mode, str(tmp_path)], stdin=zstdcat.stdout, stderr=subprocess.PIPE)
+        # Let zstdcat see a broken pipe if cruncher dies
+        zstdcat.stdout.close()
+        _, cruncher_err = cruncher.communicate()
+        zstdcat.wait()
+        zstdcat_err.seek(0)
+        errors = []
+        if zstdcat.returncode != 0:
+            errors.append(f"zstdcat exited with {zstdcat.returncode}: {zstdcat_err.read().decode(errors='replace').strip()}")
+        if cruncher.returncode != 0:
+            errors.append(f"cruncher exited with {cruncher.returncode}: {cruncher_err.decode(errors='replace').strip()[-2000:]}")
+
+    if errors:
+        tmp_path.unlink(missing_ok=True)
+        raise Exception(f"Error crunching {input_path}\n" + "\n".join(errors))
+    os.replace(tmp_path, output_path)
+    return time.time() - start
+
+
+# Run a pipeline then hand its output to on_done on the same worker
+# A blocking on_done (e.g. a full UploadQueue) holds this worker back from starting its next pipeline
+def crunch_then(on_done, input_path, mode, output_path):
+    seconds = crunch(input_path, mode, output_path)
+    if on_done:
+        on_done(output_path)
+    return seconds
+
+
+# Run jobs [(input_path, mode, output_path)] over a pool of pipelines, returns the failed jobs
+# on_done(output_path) is called on the worker thread as each job succeeds
+def crunch_all(jobs, workers=None, on_done=None):
+    workers = workers or default_workers()
+    jobs = sorted(jobs, key=lambda job: Path(job[0]).stat().st_size, reverse=True)
+    print(f"Crunching {len(jobs)} files, {workers} at a time")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(crunch_then, on_done, *job): job for job in jobs}
+        for future in as_completed(futures):
+            input_path, _, output_path = futures[future]
+            try:
+                seconds = future.result()
+            except Exception as e:
+                print(e)
+                failed.append(futures[future])
+                continue
+            mb = Path(input_path).stat().st_size / 1024 / 1024
+            print(f"{Path(input_path).name}: {mb:.0f} MB in {seconds:.0f}s ({mb / max(seconds, 1e-6):.1f} MB/s)")
+
+    print(f"Crunched {len(jobs) - len(failed)} of {len(jobs)} files")
+    for input_path, _, _ in failed:
+        print(f"Failed: {input_path}")
+    return failed
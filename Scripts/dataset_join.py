@@ -1,7 +1,9 @@
+import sys, os
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import s3_to_local_path, download_all, upload, download, upload_all
-import sys, os
+from dataset_sort import daily_means
+from join_keys import SymbolDayGrid, days_to_strings, to_days
 from pathlib import Path
 import pandas as pd
 from pathlib import Path
@@ -17,6 +19,9 @@ Includes:
     - marketdata/daily_prices.parquet
     - marketdata/sp500_daily_prices.parquet
 
+Dates are int32 day numbers and symbols int16 codes throughout the join (see join_keys.py), the symbol x day grid
+is filled by position rather than merged, and only the output is turned back into "YYYY-MM-DD" strings.
+
 USAGE:
 python3 dataset_join.py download      FOR DOWNLOADING ALL DATASETS
 python3 dataset_join.py join          FOR JOINING ALL DATASETS
@@ -37,70 +42,44 @@ def download_datasets():
     download_all("marketdata/", overwrite=False)
 
 
-def join_datasets():
-    news_dfs = []
-    for path in s3_to_local_path("processed/news/news_date_sentiment/").glob("*.parquet"):
-        news_dfs.append(pd.read_parquet(path).reset_index().assign(symbol=path.stem))
-    news = pd.concat(news_dfs, ignore_index=True).reset_index(drop=True)
-    news["dt"] = pd.to_datetime(news.dt).dt.date.astype(str)
-
-    submissions_dfs = []
-    for path in s3_to_local_path("processed/reddit/submissions_date_sentiment/").glob("*.parquet"):
-        submissions_dfs.append(pd.read_parquet(path).reset_index().assign(symbol=path.stem))
-    submissions = pd.concat(submissions_dfs, ignore_index=True).reset_index(drop=True)
-    submissions["dt"] = pd.to_datetime(submissions.dt).dt.date.astype(str)
+# Daily mean of one sentiment column for every symbol under a date_sentiment prefix, keyed by int32 day number
+def load_daily_sentiment(prefix, column):
+    dfs = []
+    for path in s3_to_local_path(prefix).glob("*.parquet"):
+        means = daily_means(pd.read_parquet(path))
+        dfs.append(pd.DataFrame({"symbol": path.stem, "day": to_days(means.index), column: means[column].to_numpy()}))
+    return pd.concat(dfs, ignore_index=True)
 
-    comments_dfs = []
-    for path in s3_to_local_path("processed/reddit/comments_date_sentiment/").glob("*.parquet"):
-        comments_dfs.append(pd.read_parquet(path).reset_index().assign(symbol=path.stem))
-    comments = pd.concat(comments_dfs, ignore_index=True).reset_index(drop=True)
-    comments["dt"] = pd.to_datetime(comments.dt).dt.date.astype(str)
 
+def join_datasets():
+    sentiment_column = "roberta_normalised_compound"
+    news = load_daily_sentiment("processed/news/news_date_sentiment/", sentiment_column)
+    submissions = load_daily_sentiment("processed/reddit/submissions_date_sentiment/", sentiment_column)
+    comments = load_daily_sentiment("processed/reddit/comments_date_sentiment/", sentiment_column)
 
     prices = pd.read_parquet(s3_to_local_path("marketdata/daily_prices.parquet"))
     sp500_prices = pd.read_parquet(s3_to_local_path("marketdata/sp500_daily_prices.parquet"))
 
-    # Duplicate date range for each symbol
-    date_range_dfs = []
-    symbols = news.symbol.unique()
-    for symbol in symbols:
-        date_range_dfs.append(
-            pd.DataFrame({
-                "dt": pd.date_range(date(2004, 1, 1), date(2025, 1, 1)),
-                "symbol": symbol,
-            }),
-        )
-    df = pd.concat(date_range_dfs, ignore_index=True).reset_index(drop=True)
-    df["dt"] = df.dt.dt.date.astype(str)
-
-
-    sentiment_column = "roberta_normalised_compound"
-
-
-    df = df.merge(news[["symbol", "dt", sentiment_column]].rename(columns={
-        sentiment_column: "news_sentiment",
-    }), how="left", on=["symbol", "dt"])
-    df = df.merge(submissions[["symbol", "dt", sentiment_column]].rename(columns={
-        sentiment_column: "submissions_sentiment",
-    }), how="left", on=["symbol", "dt"])
-    df = df.merge(comments[["symbol", "dt", sentiment_column]].rename(columns={
-        sentiment_column: "comments_sentiment",
-    }), how="left", on=["symbol", "dt"])
+    # Every day in the range for each news symbol, other data is joined onto this
+    grid = SymbolDayGrid(news.symbol.unique(), to_days(date(2004, 1, 1)), to_days(date(2025, 1, 1)))
+    grid.add("news_sentiment", news.symbol, news.day, news[sentiment_column])
+    grid.add("submissions_sentiment", submissions.symbol, submissions.day, submissions[sentiment_column])
+    grid.add("comments_sentiment", comments.symbol, comments.day, comments[sentiment_column])
 
     # Prices
-    prices["date"] = prices.date.dt.date.astype(str)
-    df = df.merge(prices[["symbol", "date", "open", "close", "high", "low"]].rename(columns={
-        "date": "dt", 
-    }), how="left", on=["symbol", "dt"])
+    price_days = to_days(prices.date)
+    for column in ["open", "close", "high", "low"]:
+        grid.add(column, prices.symbol, price_days, prices[column])
 
     # Index prices
-    sp500_prices["Date"] = pd.to_datetime(sp500_prices.Date, dayfirst=True)
-    sp500_prices["Date"] = sp500_prices.Date.dt.date.astype(str)
-    sp500_prices["Open"] = sp500_prices.Open.str.replace(",", "").astype(float)
-    sp500_prices["Price"] = sp500_prices.Price.str.replace(",", "").astype(float)
-    df = df.merge(sp500_prices[["Date", "Open", "Price"]].rename(columns={
-        "Date": "dt", "Open": "sp500_open", "Price": "sp500_close",
-    }), how="left", on=["dt"])
+    sp500_days = to_days(sp500_prices.Date, dayfirst=True)
+    grid.add_daily("sp500_open", sp500_days, sp500_prices.Open.str.replace(",", "").astype(float))
+    grid.add_daily("sp500_close", sp500_days, sp500_prices.Price.str.replace(",", "").astype(float))
+
+    # Readable dates and symbols only for the output
+    df = grid.frame
+    df.insert(0, "dt", days_to_strings(df.pop("day")))
+    df["symbol"] = df.symbol.astype(str)
 
     s3_to_local_path("datasets/").mkdir(exist_ok=True, parents=True)
     path = s3_to_local_path("datasets/roberta.parquet")
@@ -1,9 +1,16 @@
-import sys
+import sys, os
+import hashlib
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import *
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 """
@@ -27,66 +34,170 @@ USAGE:
 
     python dataset_join.py reddit-comments <TICKER>
         Process a single Reddit comment file for the given <TICKER>.
+
+Scored files are read straight from S3, fetching only the date and roberta columns. The -all commands sort
+one file per worker process (as many as there are cores), so only a file per core is ever in memory.
+Outputs are written to a .tmp file and renamed into place, so an interrupted run never leaves a partial output.
+
+Outputs hold mergeable statistics rather than means: per day, the count, sum and sum of squares of each roberta
+column (<column>_count, <column>_sum, <column>_sumsq), so daily_means() and daily_variances() can be derived and
+new rows can be added without touching the rest of the history. Each output records a fingerprint of the input it
+was built from (its ETag, row count and a hash of its dates and scores). Inputs whose ETag still matches are skipped. Scored
+files only grow by rows appended to the end (artifacts are merged existing rows first), so if the old rows and their
+scores are unchanged just the new ones are aggregated and folded into the dates they fall on; otherwise the ticker is rebuilt.
 """
 
-def all_files(file_path):
-    if "news" in file_path:
-        output_dir = "processed/news/news_date_sentiment"
-    elif "submissions" in file_path:
-        output_dir = "processed/reddit/submissions_date_sentiment"
-    elif "comments" in file_path:
-        output_dir = "processed/reddit/comments_date_sentiment"
-    else:
-        raise ValueError("Unrecognized file path.")
-    # Get all files in directory
-    dfs = [
-        (f, pd.read_parquet(f)) for f in s3_to_local_path(file_path).glob("*")
-    ]
-    for path, df in tqdm(dfs):
-        out_path = s3_to_local_path(f"{output_dir}/{path.stem}.parquet")
-        out_path.parent.mkdir(exist_ok=True, parents=True)
-        if not out_path.exists():
-            print(out_path)
-            if "reddit" in file_path:
-                # Rename datetime to dt
-                df = df.rename(columns={"datetime": "dt"})
-            df = df[["dt", "roberta_pos", "roberta_neu", "roberta_neg", "roberta_compound", "roberta_normalised_compound"]]        
-            df["dt"] = pd.to_datetime(df["dt"], unit="ms").dt.date        
-            # Get average sentiment for each day
-            df = df.groupby("dt").mean()
-            df.to_parquet(out_path)
+SENTIMENT_COLUMNS = ["roberta_pos", "roberta_neu", "roberta_neg", "roberta_compound", "roberta_normalised_compound"]
+STATISTICS = ["count", "sum", "sumsq"]
+# Parquet metadata key of an output's input fingerprint
+FINGERPRINT_KEY = b"sentiment_input"
 
+# Reddit files use datetime rather than dt
+def date_column(file_path):
+    return "datetime" if "reddit" in file_path else "dt"
 
-# One file at a time
-def single_file(file_path, ticker):
+def output_dir(file_path):
     if "news" in file_path:
-        output_dir = "processed/news/news_date_sentiment"
+        return "processed/news/news_date_sentiment"
     elif "submissions" in file_path:
-        output_dir = "processed/reddit/submissions_date_sentiment"
+        return "processed/reddit/submissions_date_sentiment"
     elif "comments" in file_path:
-        output_dir = "processed/reddit/comments_date_sentiment"
+        return "processed/reddit/comments_date_sentiment"
+    raise ValueError("Unrecognized file path.")
+
+
+# Count, sum and sum of squares of each roberta column per day, NaN scores aren't counted
+def daily_statistics(df):
+    df = df.rename(columns={"datetime": "dt"})
+    dt = pd.to_datetime(df["dt"], unit="ms").dt.date
+    scores = df[SENTIMENT_COLUMNS]
+    statistics = pd.concat([
+        scores.notna().rename(columns=lambda column: f"{column}_count"),
+        scores.fillna(0).rename(columns=lambda column: f"{column}_sum"),
+        (scores**2).fillna(0).rename(columns=lambda column: f"{column}_sumsq"),
+    ], axis=1)
+    statistics = statistics.groupby(dt.rename("dt")).sum()
+    return statistics[[f"{column}_{statistic}" for column in SENTIMENT_COLUMNS for statistic in STATISTICS]]
+
+
+# Fold daily statistics together, days in both are added up
+def merge_statistics(*statistics):
+    return pd.concat(statistics).groupby(level="dt").sum().sort_index()
+
+
+# Average sentiment per day, in the roberta columns, from an output's statistics
+def daily_means(statistics):
+    return pd.DataFrame({
+        column: statistics[f"{column}_sum"] / statistics[f"{column}_count"].replace(0, np.nan)
+        for column in SENTIMENT_COLUMNS
+    })
+
+
+# Population variance of sentiment per day, in the roberta columns, from an output's statistics
+def daily_variances(statistics):
+    means = daily_means(statistics)
+    return pd.DataFrame({
+        column: statistics[f"{column}_sumsq"] / statistics[f"{column}_count"].replace(0, np.nan) - means[column]**2
+        for column in SENTIMENT_COLUMNS
+    })
+
+
+# Hash of the first rows of a scored file's dates and scores
+# Scores are included, so a file rescored with the same rows (new backend, chunking policy etc.) is rebuilt
+def rows_hash(dates, scores, rows=None):
+    digest = hashlib.blake2b(np.ascontiguousarray(dates[:rows], dtype=np.int64).tobytes(), digest_size=16)
+    digest.update(np.ascontiguousarray(scores[:rows], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+# Input fingerprint an output was built from, None if it doesn't exist or predates fingerprints
+def read_fingerprint(out_path):
+    if not Path(out_path).exists():
+        return None
+    fingerprint = pq.read_schema(out_path).metadata.get(FINGERPRINT_KEY)
+    return json.loads(fingerprint) if fingerprint else None
+
+
+def write_statistics(statistics, out_path, fingerprint):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(exist_ok=True, parents=True)
+    table = pa.Table.from_pandas(statistics)
+    table = table.replace_schema_metadata({**table.schema.metadata, FINGERPRINT_KEY: json.dumps(fingerprint).encode()})
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
+# Bring one scored file's daily statistics up to date with the given version (S3 manifest entry) of it
+# Runs in a worker process, only one file is in memory at a time. Returns (rows aggregated, days touched, rebuilt)
+def sort_file(s3_path, out_path, entry):
+    df = read_parquet(s3_path, columns=[date_column(s3_path)] + SENTIMENT_COLUMNS, size=entry["size"])
+    dates = df[date_column(s3_path)].to_numpy()
+    scores = df[SENTIMENT_COLUMNS].to_numpy(dtype=np.float64)
+    fingerprint = {"etag": entry["etag"], "rows": len(df), "rows_hash": rows_hash(dates, scores)}
+
+    # Only fold in rows added since the last run, if the rows before them are the same ones with the same scores
+    # Fingerprints from before scores were hashed have no rows_hash, so those outputs are rebuilt
+    previous = read_fingerprint(out_path)
+    if previous and previous["rows"] <= len(df) and previous.get("rows_hash") == rows_hash(dates, scores, previous["rows"]):
+        new_rows = daily_statistics(df.iloc[previous["rows"]:])
+        statistics = merge_statistics(pd.read_parquet(out_path), new_rows)
+        rebuilt = False
     else:
-        raise ValueError("Unrecognized file path.")
-    path = s3_to_local_path(f"{file_path}/{ticker}.parquet")
-    df = pd.read_parquet(path)
-    df = df[["dt", "roberta_pos", "roberta_neu", "roberta_neg", "roberta_compound", "roberta_normalised_compound"]]
-    # Convert to datetime
-    df["dt"] = pd.to_datetime(df["dt"], unit="ms").dt.date
-    # Get average sentiment for each day
-    df = df.groupby("dt").mean()
-    df.to_parquet(s3_to_local_path(f"{output_dir}/{ticker}.parquet"))
-    return
+        new_rows = statistics = daily_statistics(df)
+        rebuilt = True
 
+    write_statistics(statistics, out_path, fingerprint)
+    return len(df) - (0 if rebuilt else previous["rows"]), len(new_rows), rebuilt
 
+
+# Files under file_path that are new or have changed since their output was built, as [(s3 path, out path, entry)]
+def pending_files(file_path):
+    pending = []
+    for path, entry in stream_manifest(file_path):
+        out_path = s3_to_local_path(f"{output_dir(file_path)}/{Path(path).stem}.parquet")
+        if path.endswith(".parquet") and (read_fingerprint(out_path) or {}).get("etag") != entry["etag"]:
+            pending.append((path, out_path, entry))
+    return pending
+
+
+# Every file under file_path that's new or changed, sorted across a pool of worker processes
+def all_files(file_path, workers=None):
+    pending = pending_files(file_path)
+    # Largest first, so a big ticker doesn't start last
+    pending.sort(key=lambda task: task[2]["size"], reverse=True)
+    print(f"Sorting {len(pending)} new or changed files")
+
+    # Spawn rather than fork, the parent's boto3 connections can't be shared with children
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+        futures = {pool.submit(sort_file, path, out_path, entry): out_path for path, out_path, entry in pending}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            rows, days, rebuilt = future.result()
+            tqdm.write(f"{futures[future]}: {'rebuilt from' if rebuilt else 'folded in'} {rows} rows, {days} days")
+
+
+# One file at a time
+def single_file(file_path, ticker):
+    s3_path = f"{file_path.rstrip('/')}/{ticker}.parquet"
+    out_path = s3_to_local_path(f"{output_dir(file_path)}/{ticker}.parquet")
+    entry = dict(s3_iter_objects(s3_path)).get(s3_path)
+    if entry is None:
+        raise Exception(f"{s3_path} doesn't exist")
+    if (read_fingerprint(out_path) or {}).get("etag") == entry["etag"]:
+        print(f"{out_path} is up to date")
+        return
+    sort_file(s3_path, out_path, entry)
+
+
+# Scored inputs are read from S3 as needed, only existing outputs are mirrored
 def get_from_s3():    
-    download_all("processed/news/twitter_roberta/", overwrite=False)
     download_all("processed/news/news_date_sentiment/", overwrite=False)
-    download_all("processed/reddit/comments_twitter_roberta/", overwrite=False)
     download_all("processed/reddit/comments_date_sentiment/", overwrite=False)
-    download_all("processed/reddit/submissions_twitter_roberta/", overwrite=False)
     download_all("processed/reddit/submissions_date_sentiment/", overwrite=False)
 
 
+# Outputs are rewritten in place when their input grows, overwrite=False still uploads them as they're newer
 def put_to_s3():
     upload_all("processed/news/news_date_sentiment/", overwrite=False)
     upload_all("processed/reddit/submissions_date_sentiment/", overwrite=False)
@@ -1,7 +1,8 @@
-from s3 import s3_to_local_path, download_all, upload
+from s3 import s3_to_local_path, download_all, upload, read_parquet_all
 import pandas as pd
 from matplotlib import pyplot as plt
-from datetime import timedelta
+from pathlib import Path
+from join_keys import SymbolDayGrid, days_to_dates, ms_to_days, to_days
 
 """
 Big old join, produces a table with columns:
@@ -15,86 +16,51 @@ Plus price data
 - close, low, high, open
 
 We also roll sentiment data into tomorrows date, meaning we can trade at *current day* close instead of lagging by 1 day.
-"""
 
-def load_comments():
-    comments = s3_to_local_path("processed/reddit/comments_twitter_roberta/")
-    df = pd.concat([
-        pd.read_parquet(path).assign(symbol=path.stem) for path in comments.glob("*.parquet")
-    ])
-    df['date'] = pd.to_datetime(df.datetime, unit='ms')
-    df['date'] = df.date.add(timedelta(hours=5)).dt.date # Move late posts into tomorrows data
-    df['weighted_roberta'] = df.roberta_normalised_compound * df.score
-    posts = df.groupby('post_id').agg({
-        'date': 'last',
-        'subreddit': 'last',
-        'symbol': 'last',
-        'score': 'last',
-        'weighted_roberta': 'last',
-    })
-    days = posts.groupby(['date', 'symbol', 'subreddit']).agg({
-        'score': 'sum',
-        'weighted_roberta': 'sum',
-    }).reset_index()
-    days['avg_sentiment'] = days.weighted_roberta / days.score
-    subs = days.subreddit.unique()
-    symbols = days.symbol.unique()
-    # New dataframe with symbol and date index
-    ndf = pd.concat([
-        pd.DataFrame({
-            'date': pd.date_range(days.date.min(), days.date.max()),
-            'symbol': symbol,
-        }) for symbol in symbols
-    ])
-    ndf['date'] = ndf.date.dt.date
-    for sub in subs:
-        ndf = ndf.merge(days[days.subreddit == sub][['date', 'symbol', 'avg_sentiment']].rename(columns={'avg_sentiment': 'ft_comments_' + sub}), on=['date', 'symbol'], how='left')
-    return ndf.rename(columns={'datetime': 'dr'})
-    
+Sentiment files are read straight from S3 with only the columns below, so the large text column is never transferred.
 
+Dates are int32 day numbers and symbols categorical (int16 codes) throughout (see join_keys.py). Posts from all three
+sources are averaged per symbol, day and source with one group-by, then pivoted into the ft_* columns of a symbol x
+day grid in one reshape, rather than merged in one source at a time. Days only become dates in the returned table.
+"""
 
-def load_submissions():
-    submissions = s3_to_local_path("processed/reddit/submissions_twitter_roberta/")
+REDDIT_COLUMNS = ['post_id', 'datetime', 'subreddit', 'score', 'roberta_normalised_compound']
+NEWS_COLUMNS = ['url', 'dt', 'domain', 'roberta_normalised_compound']
+
+# One row per post for a reddit source ('comments' or 'submissions'), as (day, symbol, feature, weighted_roberta, weight)
+def load_reddit(kind):
     df = pd.concat([
-        pd.read_parquet(path).assign(symbol=path.stem) for path in submissions.glob("*.parquet")
+        df.assign(symbol=Path(path).stem)
+        for path, df in read_parquet_all(f"processed/reddit/{kind}_twitter_roberta/", columns=REDDIT_COLUMNS)
     ])
-    df['date'] = pd.to_datetime(df.datetime, unit='ms')
-    df['date'] = df.date.add(timedelta(hours=5)).dt.date # Move late posts into tomorrows data
+    df['symbol'] = df.symbol.astype('category')
+    df['day'] = ms_to_days(df.datetime, shift_hours=5) # Move late posts into tomorrows data
     df['weighted_roberta'] = df.roberta_normalised_compound * df.score
     posts = df.groupby('post_id').agg({
-        'date': 'last',
+        'day': 'last',
         'subreddit': 'last',
         'symbol': 'last',
         'score': 'last',
         'weighted_roberta': 'last',
     })
-    days = posts.groupby(['date', 'symbol', 'subreddit']).agg({
-        'score': 'sum',
-        'weighted_roberta': 'sum',
-    }).reset_index()
-    days['avg_sentiment'] = days.weighted_roberta / days.score
-    subs = days.subreddit.unique()
-    symbols = days.symbol.unique()
-    # New dataframe with symbol and date index
-    ndf = pd.concat([
-        pd.DataFrame({
-            'date': pd.date_range(days.date.min(), days.date.max()),
-            'symbol': symbol,
-        }) for symbol in symbols
-    ])
-    ndf['date'] = ndf.date.dt.date
-    for sub in subs:
-        ndf = ndf.merge(days[days.subreddit == sub][['date', 'symbol', 'avg_sentiment']].rename(columns={'avg_sentiment': 'ft_submissions_' + sub}), on=['date', 'symbol'], how='left')
-    return ndf.rename(columns={'datetime': 'dr'})
+    return pd.DataFrame({
+        'day': posts.day,
+        'symbol': posts.symbol,
+        'feature': f'ft_{kind}_' + posts.subreddit,
+        'weighted_roberta': posts.weighted_roberta,
+        'weight': posts.score,
+    })
 
+
+# One row per article, as (day, symbol, feature, weighted_roberta, weight), and the num_sources domains to keep
 def load_news(num_sources=50):
-    news = s3_to_local_path("processed/news/twitter_roberta/")
     df = pd.concat([
-        pd.read_parquet(path).assign(symbol=path.stem) for path in news.glob("*.parquet")
+        df.assign(symbol=Path(path).stem)
+        for path, df in read_parquet_all("processed/news/twitter_roberta/", columns=NEWS_COLUMNS)
     ])
     df = df.drop_duplicates(['url'], keep='last')
-    df['date'] = pd.to_datetime(df.dt, unit='ms')
-    df['date'] = df.date.add(timedelta(hours=5)).dt.date # Move late posts into tomorrows data
+    df['symbol'] = df.symbol.astype('category')
+    df['day'] = ms_to_days(df.dt, shift_hours=5) # Move late posts into tomorrows data
     df['domain'] = (
         df.domain.str.replace(' ', '_')
             .str.replace(',', '')
@@ -109,95 +75,67 @@ def load_news(num_sources=50):
     # Equally weighted for now
     df['weighted_roberta'] = df.roberta_normalised_compound
     df['weight'] = 1
-    posts = df.groupby('url').agg({
-        'date': 'last',
-        'domain': 'last',
-        'symbol': 'last',
-        'weighted_roberta': 'last',
-        'weight': 'last',
-    })
-    days = posts.groupby(['date', 'symbol', 'domain']).agg({
-        'weighted_roberta': 'sum',
-        'weight': 'sum',
-    }).reset_index()
-    days['avg_sentiment'] = days.weighted_roberta / days.weight
-    
+
     # We cant use all news sources, select those with the best coverage (articles over most days)
-    t = df.drop_duplicates(['date', 'domain'], keep='last')
+    t = df.drop_duplicates(['day', 'domain'], keep='last')
     # Group rest into 'other'?
     sources = t.domain.value_counts().sort_values()[-num_sources:].reset_index().domain.to_list()
-    symbols = days.symbol.unique()
-
-    # New dataframe with symbol and date index
-    ndf = pd.concat([
-        pd.DataFrame({
-            'date': pd.date_range(days.date.min(), days.date.max()),
-            'symbol': symbol,
-        }) for symbol in symbols
-    ])
-    ndf['date'] = ndf.date.dt.date
-    for source in sources:
-        ndf = ndf.merge(days[days.domain == source][['date', 'symbol', 'avg_sentiment']].rename(columns={'avg_sentiment': 'ft_news_' + source}), on=['date', 'symbol'], how='left')
-    return ndf
+    return pd.DataFrame({
+        'day': df.day,
+        'symbol': df.symbol,
+        'feature': 'ft_news_' + df.domain,
+        'weighted_roberta': df.weighted_roberta,
+        'weight': df.weight,
+    }), ['ft_news_' + source for source in sources]
+
 
+# Features in the order they first appear when sorted by day, symbol and name
+def features_in_order(days, prefix):
+    features = days.index.get_level_values('feature')
+    return list(features[features.str.startswith(prefix)].unique())
 
 
 def join_datasets_with_sources():
-    comments_df = load_comments()
-    submissions_df = load_submissions()
-    news_df = load_news()
-    prices = pd.read_parquet(s3_to_local_path("marketdata/daily_prices.parquet"))
-    sp500_prices = pd.read_parquet(s3_to_local_path("marketdata/sp500_daily_prices.parquet"))
+    news_posts, news_features = load_news()
+    posts = pd.concat([load_reddit('comments'), load_reddit('submissions'), news_posts], ignore_index=True)
+    posts['symbol'] = posts.symbol.astype('category')
+    del news_posts
 
-    # Get all symbols across datasets
-    symbols = []
-    symbols += list(comments_df.symbol.unique())
-    symbols += list(submissions_df.symbol.unique())
-    symbols += list(news_df.symbol.unique())
-    symbols = list(set(symbols))
-    start_date = min(comments_df.date.min(), submissions_df.date.min(), news_df.date.min())
-    end_date = max(comments_df.date.max(), submissions_df.date.max(), news_df.date.max())
+    # Average sentiment per symbol, day and source in one pass over every source
+    days = posts.groupby(['day', 'symbol', 'feature'], observed=True)[['weighted_roberta', 'weight']].sum()
+    avg_sentiment = days.weighted_roberta / days.weight
+    del posts
 
-    # New dataframe with symbol and date index
-    df = pd.concat([
-        pd.DataFrame({
-            'date': pd.date_range(start_date, end_date),
-            'symbol': symbol,
-        }) for symbol in symbols
-    ])
-    df['date'] = df.date.dt.date
+    # Every symbol and day with any posts, whether or not its source is kept as a feature
+    symbols = days.index.get_level_values('symbol')
+    day_numbers = days.index.get_level_values('day')
+    grid = SymbolDayGrid(symbols.unique(), day_numbers.min(), day_numbers.max())
 
-    # Join columns
-    comments_columns = [c for c in comments_df.columns if c.startswith("ft_")]
-    submissions_columns = [c for c in submissions_df.columns if c.startswith("ft_")]
-    news_columns = [c for c in news_df.columns if c.startswith("ft_")]
-    df = df.merge(comments_df[["symbol", "date"] + comments_columns], how="left", on=["symbol", "date"])
-    df = df.merge(submissions_df[["symbol", "date"] + submissions_columns], how="left", on=["symbol", "date"])
-    df = df.merge(news_df[["symbol", "date"] + news_columns], how="left", on=["symbol", "date"])
+    # Pivot sources into ft_* columns in one reshape, comments, then submissions, then news
+    features = features_in_order(days, 'ft_comments_') + features_in_order(days, 'ft_submissions_') + news_features
+    grid.add_pivot(features, symbols, day_numbers, days.index.get_level_values('feature'), avg_sentiment)
 
     # Prices
-    prices["date"] = prices.date.dt.date.astype(str)
-    df = df.merge(prices[["symbol", "date", "open", "close", "high", "low"]], how="left", on=["symbol", "date"])
+    prices = pd.read_parquet(s3_to_local_path("marketdata/daily_prices.parquet"))
+    sp500_prices = pd.read_parquet(s3_to_local_path("marketdata/sp500_daily_prices.parquet"))
+    price_days = to_days(prices.date)
+    for column in ["open", "close", "high", "low"]:
+        grid.add(column, prices.symbol, price_days, prices[column])
 
     # Index prices
-    sp500_prices["Date"] = pd.to_datetime(sp500_prices.Date, dayfirst=True)
-    sp500_prices["Date"] = sp500_prices.Date.dt.date.astype(str)
-    sp500_prices["Open"] = sp500_prices.Open.str.replace(",", "").astype(float)
-    sp500_prices["Price"] = sp500_prices.Price.str.replace(",", "").astype(float)
-    df = df.merge(sp500_prices[["Date", "Open", "Price"]].rename(columns={
-        "Date": "date", "Open": "sp500_open", "Price": "sp500_close",
-    }), how="left", on=["date"])
-    return df.rename(columns={'date': 'dt'})
+    sp500_days = to_days(sp500_prices.Date, dayfirst=True)
+    grid.add_daily("sp500_open", sp500_days, sp500_prices.Open.str.replace(",", "").astype(float))
+    grid.add_daily("sp500_close", sp500_days, sp500_prices.Price.str.replace(",", "").astype(float))
+
+    # Readable dates and symbols only for the output
+    df = grid.frame
+    df.insert(0, "dt", pd.Series(days_to_dates(df.pop("day"))).dt.date)
+    df["symbol"] = df.symbol.astype(str)
+    return df
 
 if __name__ == "__main__":
-    # Ensure we have all required data
-    s3_to_local_path("processed/news/twitter_roberta/").mkdir(parents=True, exist_ok=True)
-    s3_to_local_path("processed/reddit/submissions_twitter_roberta/").mkdir(parents=True, exist_ok=True)
-    s3_to_local_path("processed/reddit/comments_twitter_roberta/").mkdir(parents=True, exist_ok=True)
+    # Ensure we have price data, sentiment is read directly from S3
     s3_to_local_path("marketdata/").mkdir(parents=True, exist_ok=True)
-    download_all("processed/news/twitter_roberta/", overwrite=False)
-    download_all("processed/reddit/submissions_twitter_roberta/", overwrite=False)
-    download_all("processed/reddit/comments_twitter_roberta/", overwrite=False)
     download_all("marketdata/", overwrite=False)
 
     # Join and upload
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+"""
+Compact keys for the dataset joins: days as int32 day numbers (days since 1970-01-01) and symbols as int16 codes
+into a sorted symbol list, so joins work on small integers rather than date objects or strings.
+
+SymbolDayGrid is the dense symbol x day table the joins fill in. Every (symbol, day) maps straight to a row, so
+joining a table onto the grid is one vectorised scatter rather than a merge. Days are only turned back into
+readable dates when the result is written out.
+
+    grid = SymbolDayGrid(symbols, to_days("2004-01-01"), to_days("2025-01-01"))
+    grid.add("news_sentiment", news.symbol, news.day, news.roberta_normalised_compound)
+    grid.add_pivot(columns, symbols, days, features, values)   # one column per feature
+    grid.add_daily("sp500_close", sp500.day, sp500.close)
+    df = grid.frame
+"""
+
+MS_PER_DAY = 86_400_000
+MS_PER_HOUR = 3_600_000
+
+
+# Day numbers from epoch milliseconds, shifted by shift_hours first
+def ms_to_days(ms, shift_hours=0):
+    return ((np.asarray(ms, dtype=np.int64) + shift_hours * MS_PER_HOUR) // MS_PER_DAY).astype(np.int32)
+
+
+# Day numbers from anything pd.to_datetime understands (dates, strings, datetimes), kwargs go to pd.to_datetime
+def to_days(values, **kwargs):
+    dates = pd.to_datetime(values, **kwargs)
+    if np.ndim(dates) == 0:
+        return np.int32(dates.to_datetime64().astype("datetime64[D]").astype(np.int64))
+    return np.asarray(dates, dtype="datetime64[ns]").astype("datetime64[D]").astype(np.int64).astype(np.int32)
+
+
+# datetime64[D] from day numbers, for the output boundary
+def days_to_dates(days):
+    return np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+
+
+# "YYYY-MM-DD" strings from day numbers, for the output boundary
+def days_to_strings(days):
+    return np.datetime_as_string(days_to_dates(days), unit="D").astype(object)
+
+
+# int16 codes of symbols in a sorted list of symbols, -1 for symbols not in it
+def symbol_codes(symbols, categories):
+    return pd.Categorical(symbols, categories=categories).codes.astype(np.int16)
+
+
+class SymbolDayGrid:
+    def __init__(self, symbols, start_day, end_day):
+        self.symbols = sorted(set(symbols))
+        self.start_day = int(start_day)
+        self.days = int(end_day) - self.start_day + 1
+        codes = np.arange(len(self.symbols), dtype=np.int16)
+        self.frame = pd.DataFrame({
+            "day": np.tile(np.arange(self.start_day, self.start_day + self.days, dtype=np.int32), len(self.symbols)),
+            "symbol": pd.Categorical.from_codes(np.repeat(codes, self.days), categories=self.symbols),
+        })
+
+    # Grid row of each (symbol, day), and whether it's in the grid at all
+    def rows(self, symbols, days):
+        codes = symbol_codes(symbols, self.symbols).astype(np.int64)
+        offsets = np.asarray(days, dtype=np.int64) - self.start_day
+        inside = (codes >= 0) & (offsets >= 0) & (offsets < self.days)
+        return codes * self.days + offsets, inside
+
+    # Left join a column keyed by (symbol, day), rows outside the grid are dropped, grid rows without one are NaN
+    # Keys are expected to be unique, the last value wins otherwise
+    def add(self, name, symbols, days, values):
+        rows, inside = self.rows(symbols, days)
+        values = np.asarray(values, dtype=np.float64)
+        column = np.full(len(self.frame), np.nan)
+        column[rows[inside]] = values[inside]
+        self.frame[name] = column
+
+    # Left join a long table of (symbol, day, feature, value) as one column per feature, in the order of columns
+    # All the columns are filled in one scatter, features not in columns are dropped
+    def add_pivot(self, columns, symbols, days, features, values):
+        rows, inside = self.rows(symbols, days)
+        column_codes = pd.Categorical(features, categories=columns).codes
+        inside &= column_codes >= 0
+        matrix = np.full((len(self.frame), len(columns)), np.nan)
+        matrix[rows[inside], column_codes[inside]] = np.asarray(values, dtype=np.float64)[inside]
+        self.frame = pd.concat([self.frame, pd.DataFrame(matrix, columns=columns, index=self.frame.index)], axis=1)
+
+    # Left join a column keyed by day only, the same for every symbol
+    def add_daily(self, name, days, values):
+        offsets = np.asarray(days, dtype=np.int64) - self.start_day
+        inside = (offsets >= 0) & (offsets < self.days)
+        column = np.full(self.days, np.nan)
+        column[offsets[inside]] = np.asarray(values, dtype=np.float64)[inside]
+        self.frame[name] = np.tile(column, len(self.symbols))
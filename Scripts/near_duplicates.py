@@ -0,0 +1,187 @@
+import sys, os
+scripts_folder = os.path.join(os.getcwd(), 'Scripts')
+sys.path.append(scripts_folder)
+import argparse
+import re
+import zlib
+import numpy as np
+from s3 import *
+from sentiment import SCORE_COLUMNS
+
+"""
+Near-duplicate detection for news, so a wire story syndicated under many domains with small edits is only scored once.
+
+Each text is reduced to a MinHash signature of its 5 word shingles. Signatures are split into LSH bands, and texts
+sharing any band with an earlier representative are candidates; a candidate whose signatures agree on at least
+threshold of their hashes (an estimate of the shingles' Jaccard similarity) joins that representative's cluster.
+Only representatives are passed to the scorer, every member gets its representative's scores.
+
+    near_duplicates = NearDuplicates(scorer, cache)
+    scores = near_duplicates.score(texts)       # like scorer.score(texts), scoring one text per cluster
+    near_duplicates.reset()                     # forget the clusters, e.g. between artifacts
+
+USAGE:
+    python3 Scripts/near_duplicates.py report processed/news/gnews_artifacts/ [--threshold 0.8] [--files 20]
+        Cluster each artifact under the prefix and report how many texts would be scored.
+    python3 Scripts/score_sentiment.py processed/news/gnews_artifacts/ --near-duplicates [0.8]
+"""
+
+NUM_PERM = 128
+# 16 bands of 8 hashes, texts with Jaccard similarity above ~0.7 are likely to share a band
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+# Estimated Jaccard similarity for texts to be near-duplicates
+THRESHOLD = 0.8
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+# Fixed permutations, so signatures are the same in every process
+permutations = np.random.RandomState(1).randint(1, int(MERSENNE_PRIME), size=(2, NUM_PERM), dtype=np.uint64)
+
+
+# Hashes of the text's lowercased 5 word shingles (or of all its words if it's shorter)
+def shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    if not words:
+        return None
+    count = max(1, len(words) - SHINGLE_WORDS + 1)
+    return np.unique(np.array([zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode()) for i in range(count)], dtype=np.uint64))
+
+
+# MinHash signature of a text, None for texts without words
+def signature(text):
+    hashes = shingles(text)
+    if hashes is None:
+        return None
+    a, b = permutations
+    # Wraps around in uint64, as datasketch does, it's still a fine hash
+    with np.errstate(over="ignore"):
+        return (((a[:, None] * hashes + b[:, None]) % MERSENNE_PRIME) & MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold=THRESHOLD):
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        # {(band, band hashes): [representative]}
+        self.buckets = {}
+        self.signatures = []
+
+    # Representative of each text, adding texts that aren't near an existing one as new representatives
+    # Returns ([representative or None for texts without words], {new representative: index of its text})
+    def cluster(self, texts):
+        representatives, new = [], {}
+        for i, text in enumerate(texts):
+            text_signature = signature(text)
+            if text_signature is None:
+                representatives.append(None)
+                continue
+            keys = [(band, text_signature[band * ROWS:(band + 1) * ROWS].tobytes()) for band in range(BANDS)]
+            candidates = {candidate for key in keys for candidate in self.buckets.get(key, ())}
+            similarity, best = max(((np.mean(self.signatures[candidate] == text_signature), candidate) for candidate in candidates), default=(0, None))
+            if similarity >= self.threshold:
+                representatives.append(best)
+                continue
+            representative = len(self.signatures)
+            self.signatures.append(text_signature)
+            for key in keys:
+                self.buckets.setdefault(key, []).append(representative)
+            representatives.append(representative)
+            new[representative] = i
+        return representatives, new
+
+
+class NearDuplicates:
+    def __init__(self, scorer, cache=None, threshold=THRESHOLD):
+        self.scorer = scorer
+        self.cache = cache
+        self.index = NearDuplicateIndex(threshold)
+        # Identifies the checkpoints this produces
+        self.model_id = f"{scorer.model_id}:neardup{threshold}"
+        # Texts given a representative's scores, and texts scored
+        self.duplicates = 0
+        self.scored = 0
+        self.reset()
+
+    def reset(self):
+        self.index.reset()
+        # Scores of each representative
+        self.scores = []
+
+    def run_scorer(self, texts):
+        return self.cache.score(texts, self.scorer) if self.cache else self.scorer.score(texts)
+
+    # Add texts already scored (e.g. checkpointed) as representatives for later texts
+    def add(self, texts, scores):
+        _, new = self.index.cluster(list(texts))
+        self.scores += [None] * len(new)
+        for representative, i in new.items():
+            self.scores[representative] = scores[i]
+
+    # Scores for texts in SCORE_COLUMNS order, only scoring one text per cluster
+    def score(self, texts):
+        texts = list(texts)
+        representatives, new = self.index.cluster(texts)
+        # Texts without words aren't clustered, they're scored as they are
+        rows = [i for i, representative in enumerate(representatives) if representative is None] + list(new.values())
+        scores = np.zeros((len(texts), len(SCORE_COLUMNS)))
+        if rows:
+            scores[rows] = self.run_scorer([texts[i] for i in rows])
+        self.scores += [None] * len(new)
+        for representative, i in new.items():
+            self.scores[representative] = scores[i]
+        for i, representative in enumerate(representatives):
+            if representative is not None and new.get(representative) != i:
+                scores[i] = self.scores[representative]
+        self.duplicates += len(texts) - len(rows)
+        self.scored += len(rows)
+        return scores
+
+
+# Cluster every artifact under a prefix separately and report how much scoring near-duplicate collapse saves
+def report(artifacts_prefix, threshold=THRESHOLD, files=None, examples=3):
+    paths = [path for path in s3_list(artifacts_prefix) if path.endswith(".parquet")][:files]
+    index = NearDuplicateIndex(threshold)
+    total_rows = total_representatives = total_words = saved_words = 0
+    largest = []
+    for path in tqdm(paths):
+        texts = [text or "" for text in read_parquet(path, columns=["text"])["text"].tolist()]
+        index.reset()
+        representatives, new = index.cluster(texts)
+        kept = {i for i, representative in enumerate(representatives) if representative is None} | set(new.values())
+        words = [len(text.split()) for text in texts]
+        total_rows += len(texts)
+        total_representatives += len(kept)
+        total_words += sum(words)
+        saved_words += sum(count for i, count in enumerate(words) if i not in kept)
+
+        clusters = {}
+        for i, representative in enumerate(representatives):
+            if representative is not None:
+                clusters.setdefault(representative, []).append(i)
+        largest += [(len(members), path, [texts[i] for i in members[:2]]) for members in clusters.values() if len(members) > 1]
+        largest = sorted(largest, key=lambda cluster: cluster[0], reverse=True)[:examples]
+
+    print(f"{len(paths)} artifacts, {total_rows} texts, {total_representatives} after collapsing near-duplicates (threshold {threshold})")
+    print(f"Texts scored: {total_representatives / max(total_rows, 1):.1%}, words scored: {1 - saved_words / max(total_words, 1):.1%}")
+    for size, path, members in largest:
+        print(f"\n{size} near-duplicates in {path}:")
+        for text in members:
+            print(f"    {text[:150]!r}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate detection for news texts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Report near-duplicate clusters in artifacts under a prefix")
+    report_parser.add_argument("prefix", help="S3 prefix of artifacts, e.g. processed/news/gnews_artifacts/")
+    report_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    report_parser.add_argument("--files", type=int, default=None, help="Only the first N artifacts")
+    report_parser.add_argument("--examples", type=int, default=3, help="Largest clusters to print")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.prefix, args.threshold, args.files, args.examples)
@@ -1,14 +1,15 @@
+import sys, os
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import *
-import sys, os
+from crunch import crunch_all
 from tqdm import tqdm
 from pathlib import Path
 import re
 
 """
 Process news zst files into parquet format.
-Downloads zst files, processes locally and uploads parquets.
+Downloads zst files without a parquet locally or in S3, processes locally (in parallel, see crunch.py) and uploads parquets in the background.
 
 USAGE:
     python process_news.py
@@ -19,22 +20,31 @@ def remove_jsonl_suffix(path):
     jsonl_removed = str(path).replace(".jsonl", "")
     return jsonl_removed
 
+# Processed parquet for a raw zst file
+def processed_path(s3_path):
+    stem = re.search(r'^.*\/([^\/]+)\.zst$', remove_jsonl_suffix(s3_path))
+    return f"processed/news/gnews/{stem.group(1)}.parquet"
+
 def process_news():
-    # Download all raw zst files
-    s3_paths = download_all("raw/news/gnews/")
-    
+    s3_to_local_path("processed/news/gnews").mkdir(parents=True, exist_ok=True)
+
+    # Outputs evicted from the local cache are still done if they're in S3
+    processed = set(refresh_manifest("processed/news/gnews/"))
+    processed |= {local_to_s3_path(path) for path in s3_to_local_path("processed/news/gnews").glob("*.parquet")}
+
+    # Download the raw zst files that still need crunching
+    s3_paths = download_all("raw/news/gnews/", include=lambda path: path.endswith(".zst") and processed_path(path) not in processed)
+
     # Hit them with the ol' Crunchertron 3000
-    for path in tqdm(s3_paths):
-        local_path = s3_to_local_path(path)
-        renamed_path = remove_jsonl_suffix(local_path)
-        #os.rename(local_path, renamed_path)
-        stem = re.search(r'^.*\/([^\/]+)\.zst$', renamed_path)
-        output_path = s3_to_local_path(f"processed/news/gnews/{stem.group(1)}.parquet")
-        if not output_path.exists():
-            print(f"{stem.group(1)}...")
-            os.system(f"zstdcat {local_path} | ./Processing/cruncher/cruncher news-articles {output_path}")
-            upload(f"processed/news/gnews/{stem.group(1)}.parquet")
-            print(f"{stem.group(1)} Uploaded.")    
+    jobs = [(s3_to_local_path(path), "news-articles", s3_to_local_path(processed_path(path))) for path in s3_paths]
+    with UploadQueue() as uploads:
+        failed = crunch_all(jobs, on_done=lambda output_path: uploads.put(local_to_s3_path(output_path)))
+
+    # Upload any not uploaded files (including any background uploads that failed)
+    upload_all("processed/news/gnews/", overwrite=False)
+    return failed
 
 if __name__ == "__main__":
-    process_news()
+    # Failed files have no output, so they'll be retried next run
+    if process_news():
+        sys.exit(1)
@@ -1,14 +1,17 @@
+import sys, os
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import *
-import sys, os
+from crunch import crunch_all
 from tqdm import tqdm
 from pathlib import Path
 
 """
 
 Process reddit torrent zst files into parquet and upload to S3.
-By default just processes locally downloaded files, uploads parquets.
+Processes raw files (local, or downloaded again if evicted from the cache) that have no parquet locally or in S3, uploads parquets.
+Files are crunched in parallel (see crunch.py), each parquet is queued for upload in the background as soon
+as it's done so crunching and uploading overlap.
 Must be invoked from group-project dir.
 
 USAGE:
@@ -19,47 +22,50 @@ python3 Scripts/process_reddit.py all                FOR EVERYTHING
 
 """
 
+# (input, output) local paths of raw files without a processed parquet, locally or in S3
+# Either side may have been evicted from the local cache: evicted outputs count as done,
+# evicted inputs that still need crunching are downloaded again
+def pending_files(data_type):
+    processed = {Path(path).stem for path in refresh_manifest(f"processed/reddit/{data_type}/")}
+    processed |= {path.stem for path in s3_to_local_path(f"processed/reddit/{data_type}").glob("*.parquet")}
+    # Raw files that haven't been uploaded yet only exist locally
+    raw = {path.stem for path in s3_to_local_path(f"raw/reddit/{data_type}").glob("*.zst")}
+    raw |= {Path(path).stem for path in download_all(f"raw/reddit/{data_type}/", include=lambda path: path.endswith(".zst") and Path(path).stem not in processed)}
+    return [
+        (s3_to_local_path(f"raw/reddit/{data_type}/{stem}.zst"), s3_to_local_path(f"processed/reddit/{data_type}/{stem}.parquet"))
+        for stem in sorted(raw - processed)
+    ]
+
 def process_reddit_all():
-    process_reddit_submissions()
-    process_reddit_comments()
+    return process_reddit_submissions() + process_reddit_comments()
 
 def process_reddit_submissions():
     s3_to_local_path("processed/reddit/submissions").mkdir(parents=True, exist_ok=True)
 
     # Process submissions locally
     print("Processing and uploading submissions...")
-    submission_paths = s3_to_local_path("raw/reddit/submissions").glob("*.zst")
-    for path in tqdm(submission_paths):
-        output_path = s3_to_local_path(f"processed/reddit/submissions/{path.stem}.parquet")
-        if not output_path.exists():
-            print(f"{path.stem}...")
-            os.system(f"zstdcat {path} | ./Processing/cruncher/cruncher reddit-submissions {output_path}")
-            upload(f"processed/reddit/submissions/{path.stem}.parquet")
-            print(f"{path.stem} Uploaded.")
+    jobs = [(path, "reddit-submissions", output_path) for path, output_path in pending_files("submissions")]
+    with UploadQueue() as uploads:
+        failed = crunch_all(jobs, on_done=lambda output_path: uploads.put(local_to_s3_path(output_path)))
 
-
-    # Upload any not uploaded files 
+    # Upload any not uploaded files (including any background uploads that failed)
     print("Uploading missing files...")
-    upload_all("processed/reddit/submissions", overwrite=False)
+    upload_all("processed/reddit/submissions/", overwrite=False)
+    return failed
 
 def process_reddit_comments():
     s3_to_local_path("processed/reddit/comments").mkdir(parents=True, exist_ok=True)
 
-    # Process submissions locally
+    # Process comments locally
     print("Processing and uploading comments...")
-    submission_paths = s3_to_local_path("raw/reddit/comments").glob("*.zst")
-    for path in tqdm(submission_paths):
-        output_path = s3_to_local_path(f"processed/reddit/comments/{path.stem}.parquet")
-        if not output_path.exists():
-            print(f"{path.stem}...")
-            os.system(f"zstdcat {path} | ./Processing/cruncher/cruncher reddit-comments {output_path}")
-            upload(f"processed/reddit/comments/{path.stem}.parquet")
-            print(f"{path.stem} Uploaded.")
-
+    jobs = [(path, "reddit-comments", output_path) for path, output_path in pending_files("comments")]
+    with UploadQueue() as uploads:
+        failed = crunch_all(jobs, on_done=lambda output_path: uploads.put(local_to_s3_path(output_path)))
 
-    # Upload any not uploaded files 
+    # Upload any not uploaded files (including any background uploads that failed)
     print("Uploading missing files...")
-    upload_all("processed/reddit/comments", overwrite=False)
+    upload_all("processed/reddit/comments/", overwrite=False)
+    return failed
 
 
 if __name__ == "__main__":
@@ -69,14 +75,16 @@ if __name__ == "__main__":
     processing_choice = sys.argv[1]
     if processing_choice == "all":
         print("Processing everything")
-        process_reddit_all()
+        failed = process_reddit_all()
     elif processing_choice == 'submissions':
         print("Processing just submissions")
-        process_reddit_submissions()
+        failed = process_reddit_submissions()
     elif processing_choice == 'comments':
         print("Processing just comments")
-        process_reddit_comments()\
-    
-
-
-    
+        failed = process_reddit_comments()
+    else:
+        print("Usage: python3 Scripts/process_reddit.py <submissions/comments/all>")
+        sys.exit(1)
+    # Failed files have no output, so they'll be retried next run
+    if failed:
+        sys.exit(1)
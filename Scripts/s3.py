@@ -1,16 +1,29 @@
 import argparse
+import io
 import json
 import pandas as pd
+import pyarrow.parquet as pq
 from joblib import Parallel, delayed
 from glob import glob
 import os
 from tqdm import tqdm
 import boto3
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+import queue
+import threading
 from dotenv import dotenv_values
 import bz2
 import pickle
 import importlib
 import sys
+import time
+import sqlite3
+from contextlib import closing, contextmanager
 from pathlib import Path
 
 
@@ -25,26 +38,70 @@ BUCKET = "sentimentgroup"
 file_path = Path(__file__).parent.resolve()
 config = dotenv_values(file_path / ".env")
 
+# Transfer tuning
+# Files are transferred TRANSFER_WORKERS at a time, large files are additionally split into
+# MULTIPART_CHUNKSIZE parts which are moved MULTIPART_CONCURRENCY at a time
+TRANSFER_WORKERS = 16
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+MULTIPART_CHUNKSIZE = 64 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+# Downloads are fetched in ranges of this size, and can resume after the last one written
+DOWNLOAD_CHUNKSIZE = 8 * 1024 * 1024
+TRANSFER_RETRIES = 5
+# Listing runs this many LIST requests at a time, see s3_iter_objects
+LIST_WORKERS = 16
+# Once a listing needs more than one page, the rest of the keyspace is split on these characters
+LIST_SHARD_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+TRANSFER_BACKOFF = 1
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=MULTIPART_CHUNKSIZE,
+    max_concurrency=MULTIPART_CONCURRENCY,
+)
+
 # S3 Stuff
+# S3_ENDPOINT is optional, use it to point at a local S3 stand-in (e.g. MinIO or moto_server)
 s3 = boto3.client(
     "s3",
     aws_access_key_id=config["S3_KEY"],
     aws_secret_access_key=config["S3_SECRET"],
     region_name=config["S3_REGION"],
+    endpoint_url=config.get("S3_ENDPOINT"),
+    # Enough connections for every worker to run a full multipart transfer
+    config=Config(max_pool_connections=TRANSFER_WORKERS * MULTIPART_CONCURRENCY),
 ) if "S3_KEY" in config else None
 
 # Local caching path
 LOCAL_PATH = Path.home() / "s3local" / BUCKET
+# Remote listings (key -> size/etag/mtime) per prefix, kept outside LOCAL_PATH so they're never uploaded
+MANIFEST_PATH = Path.home() / "s3local" / "manifests" / BUCKET
+# Access times, hit/miss counts and pins for files in LOCAL_PATH
+CACHE_DB_PATH = Path.home() / "s3local" / "cache" / f"{BUCKET}.sqlite"
+# LOCAL_PATH is trimmed back to this many bytes (least recently used first), set CACHE_BUDGET_GB in .env to change
+CACHE_BUDGET = int(float(config.get("CACHE_BUDGET_GB", 200)) * 1024 ** 3)
 ARTIFACT_PATH = Path.home() / "artifacts" / BUCKET
 
 # Get local path for a file (when saving before upload)
 def s3_to_local_path(path):
     return LOCAL_PATH / path
 
+# And back again
+def local_to_s3_path(path):
+    return str(Path(path).relative_to(LOCAL_PATH))
+
 def artifact(path):
     return ARTIFACT_PATH / path
 
-# Download a file to an equivalent local path
+# Fetch bytes start-end (inclusive) of a specific version of an object
+# IfMatch fails the request if the object has been replaced since we started
+def fetch_range(s3_path, etag, start, end):
+    response = s3.get_object(Bucket=BUCKET, Key=s3_path, Range=f"bytes={start}-{end}", IfMatch=etag)
+    return response["Body"].read()
+
+# Download a file to an equivalent local path, returns number of bytes transferred
+# Data is streamed into <name>.<etag>.part and only renamed into place once complete, so a crash never
+# leaves a truncated file at the real path, and the next attempt resumes from the last byte written
 def download(s3_path, overwrite=False):
     # Ensure the local directory exists
     local_file_path = s3_to_local_path(s3_path)
@@ -53,18 +110,147 @@ def download(s3_path, overwrite=False):
 
     # Check if the file already exists locally
     if local_file_path.is_file() and not overwrite:
-        return
+        record_access([s3_path], hit=True)
+        return 0
 
-    # Download the file from S3
-    s3.download_file(BUCKET, s3_path, str(local_file_path))
+    head = with_retries(s3.head_object, Bucket=BUCKET, Key=s3_path)
+    size, etag = head["ContentLength"], head["ETag"].strip('"')
+    part_path = local_dir / f"{local_file_path.name}.{etag}.part"
+
+    # Partial downloads of older versions can't be resumed
+    for stale_path in local_dir.glob(f"{local_file_path.name}.*.part"):
+        if stale_path != part_path:
+            stale_path.unlink()
+    offset = part_path.stat().st_size if part_path.is_file() else 0
+    if offset > size:
+        part_path.unlink()
+        offset = 0
+
+    # Fetch the remaining ranges a few at a time, writing them in order so the part file is always a valid prefix
+    with pinned(s3_path), open(part_path, "ab") as f, ThreadPoolExecutor(max_workers=MULTIPART_CONCURRENCY) as pool:
+        pending = deque()
+        for start in range(offset, size, DOWNLOAD_CHUNKSIZE):
+            end = min(start + DOWNLOAD_CHUNKSIZE, size) - 1
+            pending.append(pool.submit(with_retries, fetch_range, s3_path, etag, start, end))
+            if len(pending) >= MULTIPART_CONCURRENCY:
+                f.write(pending.popleft().result())
+                f.flush()
+        while pending:
+            f.write(pending.popleft().result())
+            f.flush()
+
+    if part_path.stat().st_size != size:
+        raise Exception(f"Error downloading {s3_path}, expected {size} bytes but got {part_path.stat().st_size}")
+    os.replace(part_path, local_file_path)
+    # Give the file the object's mtime, so needs_upload doesn't see a fresh download as rewritten since upload
+    mtime = head["LastModified"].timestamp()
+    os.utime(local_file_path, (mtime, mtime))
+    record_access([s3_path], hit=False)
+    return size - offset
 
 # Also note that uploading should be done by first writing to local dir then uploading
+# Returns number of bytes transferred
 def upload(s3_path):
     local_file_path = s3_to_local_path(s3_path)
     if not local_file_path.is_file():
         raise Exception("Error Uploading to S3, expected file in: " + str(local_file_path))
 
-    s3.upload_file(local_file_path, BUCKET, str(s3_path))
+    with pinned(s3_path):
+        with_retries(s3.upload_file, str(local_file_path), BUCKET, str(s3_path), Config=TRANSFER_CONFIG)
+    record_access([s3_path])
+    return local_file_path.stat().st_size
+
+# Error code of a failed request, upload_file wraps the ClientError in an S3UploadFailedError
+def error_code(e):
+    if isinstance(e, S3UploadFailedError):
+        e = e.__cause__ or e.__context__
+    return e.response["Error"]["Code"] if isinstance(e, ClientError) else None
+
+# Retry a single S3 request with exponential backoff
+# Only individual requests are retried (not whole transfers), so failures never multiply through nested retries
+# Missing objects, permission errors and stale ETags (412 from IfMatch) won't fix themselves so fail those straight away
+def with_retries(fn, *args, retries=TRANSFER_RETRIES, **kwargs):
+    for attempt in range(retries):
+        try:
+            return fn(*args, **kwargs)
+        except (BotoCoreError, ClientError, S3UploadFailedError) as e:
+            if attempt == retries - 1 or error_code(e) in ("403", "404", "412", "AccessDenied", "NoSuchKey", "PreconditionFailed"):
+                raise
+            wait = TRANSFER_BACKOFF * 2 ** attempt
+            print(f"{fn.__name__}{args} failed ({e}), retrying in {wait}s")
+            time.sleep(wait)
+
+# Run fn(path) for every path over a bounded thread pool and report aggregate throughput
+# Every path is attempted before raising, so one bad file doesn't stop the rest of a sync
+def transfer_all(fn, paths, workers=TRANSFER_WORKERS, **kwargs):
+    start = time.time()
+    total_bytes = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, path, **kwargs): path for path in paths}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            try:
+                total_bytes += future.result() or 0
+            except Exception as e:
+                failed.append(futures[future])
+                print(f"Error transferring {futures[future]}: {e}")
+
+    elapsed = time.time() - start
+    mb = total_bytes / 1024 / 1024
+    print(f"Transferred {len(futures) - len(failed)} files, {mb:.1f} MB in {elapsed:.1f}s ({mb / max(elapsed, 1e-6):.1f} MB/s)")
+    if failed:
+        raise Exception(f"{len(failed)} of {len(futures)} transfers failed, e.g. {failed[0]}")
+    return total_bytes
+
+# Uploads files on background threads so processing can carry on while they transfer
+# put() blocks once max_pending files are waiting, so a slow network holds back the producer
+# instead of letting finished files pile up. Failed uploads are retried with backoff on the
+# upload threads and reported by close(), they never raise into the producer.
+class UploadQueue:
+    def __init__(self, workers=4, max_pending=8):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.failed = []
+        self.uploaded_bytes = 0
+        self.start = time.time()
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, s3_path):
+        self.queue.put(str(s3_path))
+
+    def run(self):
+        while True:
+            s3_path = self.queue.get()
+            if s3_path is None:
+                return
+            try:
+                size = upload(s3_path)
+                with self.lock:
+                    self.uploaded_bytes += size
+                print(f"{s3_path} Uploaded.")
+            except Exception as e:
+                print(f"Error uploading {s3_path}: {e}")
+                with self.lock:
+                    self.failed.append(s3_path)
+
+    # Wait for everything queued to be uploaded, returns the paths that failed
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        mb = self.uploaded_bytes / 1024 / 1024
+        elapsed = time.time() - self.start
+        print(f"Uploaded {mb:.1f} MB in background ({mb / max(elapsed, 1e-6):.1f} MB/s), {len(self.failed)} failed")
+        return self.failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 # Move, has to copy and delete :(
 def move_s3_object(old_key, new_key):
@@ -78,34 +264,425 @@ def move_s3_object(old_key, new_key):
     # Delete the original object
     s3.delete_object(Bucket=BUCKET, Key=old_key)
 
-# List all paths for a given prefix (causing problems with default list function)
+def manifest_entry(obj):
+    return {
+        "size": obj["Size"],
+        "etag": obj["ETag"].strip('"'),
+        "mtime": obj["LastModified"].timestamp(),
+    }
+
+# Stream (key, manifest entry) for everything under a prefix while it is still being listed
+# Each level is listed with a "/" delimiter and every sub-prefix found is listed in parallel.
+# Levels with more than one page of keys (e.g. thousands of ticker files) are split into key
+# ranges on LIST_SHARD_CHARS after the first page, and the ranges are listed in parallel too.
+# Keys arrive in no particular order.
+def s3_iter_objects(s3_prefix, workers=LIST_WORKERS):
+    results = queue.Queue()
+    done = object()
+    lock = threading.Lock()
+    state = {"pending": 0}
+    seen_prefixes = set()
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def submit(fn, *args):
+        with lock:
+            state["pending"] += 1
+        pool.submit(run, fn, *args)
+
+    def run(fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            results.put(e)
+        finally:
+            # Children are submitted before this decrement, so we only hit zero once everything is listed
+            with lock:
+                state["pending"] -= 1
+                if state["pending"] == 0:
+                    results.put(done)
+
+    # Emit the keys and sub-prefixes from a page that fall at or before end, returns the last item seen
+    def emit(page, end):
+        last = None
+        for obj in page.get("Contents", []):
+            last = max(last or "", obj["Key"])
+            if end is None or obj["Key"] <= end:
+                results.put((obj["Key"], manifest_entry(obj)))
+        for common_prefix in page.get("CommonPrefixes", []):
+            prefix = common_prefix["Prefix"]
+            last = max(last or "", prefix)
+            if end is None or prefix <= end:
+                with lock:
+                    new = prefix not in seen_prefixes
+                    seen_prefixes.add(prefix)
+                if new:
+                    submit(list_prefix, prefix)
+        return last
+
+    # List keys in (start_after, end] for one level of a prefix
+    def list_range(prefix, start_after, end):
+        kwargs = {"Bucket": BUCKET, "Prefix": prefix, "Delimiter": "/", "StartAfter": start_after}
+        while True:
+            page = with_retries(s3.list_objects_v2, **kwargs)
+            last = emit(page, end)
+            if not page.get("IsTruncated") or (end is not None and last is not None and last > end):
+                return
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+    def list_prefix(prefix):
+        page = with_retries(s3.list_objects_v2, Bucket=BUCKET, Prefix=prefix, Delimiter="/")
+        last = emit(page, None)
+        if not page.get("IsTruncated"):
+            return
+        # Split everything after the first page into ranges that can be listed in parallel
+        boundaries = [boundary for boundary in (prefix + c for c in LIST_SHARD_CHARS) if boundary > last]
+        for start_after, end in zip([last] + boundaries, boundaries + [None]):
+            submit(list_range, prefix, start_after, end)
+
+    submit(list_prefix, str(s3_prefix))
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# List all paths for a given prefix
 def s3_list(s3_prefix):
-    paginator = s3.get_paginator("list_objects")
-    paths = []
-    for result in paginator.paginate(Bucket=BUCKET, Prefix=s3_prefix):
-        for obj in result.get("Contents", []):
-            paths.append(obj["Key"])
-    return paths
+    return sorted(key for key, _ in s3_iter_objects(s3_prefix))
+
+# Manifest file for a prefix, e.g. processed/reddit/comments/ -> processed__reddit__comments.json
+def manifest_path(s3_prefix):
+    name = str(s3_prefix).strip("/").replace("/", "__") or "_root"
+    return MANIFEST_PATH / f"{name}.json"
+
+# Last saved manifest for a prefix (empty if never listed)
+def load_manifest(s3_prefix):
+    path = manifest_path(s3_prefix)
+    if not path.is_file():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_manifest(s3_prefix, manifest):
+    path = manifest_path(s3_prefix)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+# Prefixes passed to the sync helpers are directories, so "processed/reddit/submissions" doesn't also pick up
+# keys under siblings like "processed/reddit/submissions_twitter_roberta/"
+def directory_prefix(s3_prefix):
+    s3_prefix = str(s3_prefix)
+    return s3_prefix if s3_prefix == "" or s3_prefix.endswith("/") else s3_prefix + "/"
+
+# Stream (key, entry) from a fresh listing of a prefix, saving the manifest once the listing completes
+def stream_manifest(s3_prefix):
+    s3_prefix = directory_prefix(s3_prefix)
+    manifest = {}
+    for key, entry in s3_iter_objects(s3_prefix):
+        manifest[key] = entry
+        yield key, entry
+    save_manifest(s3_prefix, dict(sorted(manifest.items())))
+
+# Rebuild the manifest for a prefix from one listing
+def refresh_manifest(s3_prefix):
+    for _ in stream_manifest(s3_prefix):
+        pass
+    return load_manifest(s3_prefix)
+
+# Remote copy is missing, a different size, or older than the local file (rewritten since upload)
+# S3 timestamps are whole seconds, so truncate the local one before comparing
+# Downloaded files are given the object's LastModified as their mtime, so they only count once rewritten
+def needs_upload(local_file_path, entry):
+    if entry is None:
+        return True
+    stat = local_file_path.stat()
+    return stat.st_size != entry["size"] or int(stat.st_mtime) > entry["mtime"]
+
+# Local copy is missing or a different size
+# (mtime isn't compared, files we produced and uploaded ourselves are always older than the remote)
+def needs_download(local_file_path, entry):
+    if not local_file_path.is_file():
+        return True
+    return local_file_path.stat().st_size != entry["size"]
 
 # Download everything for a given prefix
-def download_all(s3_prefix, overwrite=False):
-    paths = s3_list(s3_prefix)
-    for path in tqdm(paths):
-        # Skip directories
-        if str(path).endswith("/"):
-            continue
-        download(path, overwrite=overwrite)
-    return paths
+# Without overwrite, only objects missing locally or changed remotely are fetched
+# Transfers start as soon as keys are listed rather than after the whole prefix has been listed
+# With include, only keys it returns True for are fetched (and returned)
+def download_all(s3_prefix, overwrite=False, workers=TRANSFER_WORKERS, include=None):
+    s3_prefix = directory_prefix(s3_prefix)
+    paths = []
+    hits = []
+
+    def files_to_download():
+        incoming = 0
+        evicted_for = 0
+        used = None
+        for path, entry in stream_manifest(s3_prefix):
+            if include and not include(path):
+                continue
+            paths.append(path)
+            # Skip directories
+            if path.endswith("/"):
+                continue
+            if not overwrite and not needs_download(s3_to_local_path(path), entry):
+                hits.append(path)
+                continue
+            # Make room for incoming files (a GB at a time) without evicting anything from this prefix
+            # The cache is only scanned again when the incoming files would actually take it over budget
+            incoming += entry["size"]
+            if incoming > evicted_for:
+                evicted_for = incoming + 1024 ** 3
+                if used is None:
+                    used = sum(size for size, _ in local_cache_files().values())
+                if used + evicted_for > CACHE_BUDGET:
+                    used -= evict(CACHE_BUDGET - evicted_for, keep_prefix=s3_prefix)
+            yield path
+
+    transfer_all(download, files_to_download(), workers=workers, overwrite=True)
+    record_access(hits, hit=True)
+    return sorted(paths)
 
 # Upload everything for a given prefix
-def upload_all(s3_prefix, overwrite=True):
-    skip = []
-    if not overwrite:
-        skip = [str(p) for p in list(s3_prefix)]
+# Without overwrite, only files missing remotely or changed locally are sent
+def upload_all(s3_prefix, overwrite=True, workers=TRANSFER_WORKERS):
+    s3_prefix = directory_prefix(s3_prefix)
+    manifest = {} if overwrite else refresh_manifest(s3_prefix)
 
     local_prefix = s3_to_local_path(s3_prefix) 
-    for local_path in tqdm(local_prefix.rglob("*")):
+    files = []
+    for local_path in local_prefix.rglob("*"):
         path = str(local_path).replace(str(LOCAL_PATH) + "/", "")
-        if path not in skip:
-            if local_path.is_file():
-                upload(path)
+        # Skip partial downloads
+        if local_path.name.endswith(".part"):
+            continue
+        if local_path.is_file() and (overwrite or needs_upload(local_path, manifest.get(path))):
+            files.append(path)
+    transfer_all(upload, files, workers=workers)
+
+# Read-only seekable file backed by ranged GETs
+# pyarrow only reads the parquet footer and the column chunks/row groups it needs, so with this
+# column projection actually cuts the bytes transferred instead of mirroring the whole object
+class S3File(io.RawIOBase):
+    def __init__(self, s3_path, size=None):
+        self.s3_path = str(s3_path)
+        if size is None:
+            size = s3.head_object(Bucket=BUCKET, Key=self.s3_path)["ContentLength"]
+        self.size = size
+        self.position = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    def get_range(self, start, end):
+        response = s3.get_object(Bucket=BUCKET, Key=self.s3_path, Range=f"bytes={start}-{end}")
+        return response["Body"].read()
+
+    def readinto(self, buffer):
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+        data = with_retries(self.get_range, self.position, end - 1)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+# Open an S3 object for reading, small reads are buffered so footer parsing doesn't cost one GET each
+def s3_open(s3_path, size=None, buffer_size=256 * 1024):
+    return io.BufferedReader(S3File(s3_path, size=size), buffer_size=buffer_size)
+
+# Read a parquet object into pandas, fetching only the requested columns and the row groups that match filters
+# Uses the local copy instead if we already have one
+def read_parquet(s3_path, columns=None, filters=None, size=None):
+    local_file_path = s3_to_local_path(s3_path)
+    if local_file_path.is_file():
+        record_access([s3_path], hit=True)
+        with pinned(s3_path):
+            return pq.read_table(local_file_path, columns=columns, filters=filters).to_pandas()
+    record_access([s3_path], hit=False)
+    with s3_open(s3_path, size=size) as f:
+        return pq.read_table(f, columns=columns, filters=filters).to_pandas()
+
+# read_parquet every parquet object under a prefix in parallel, returns [(s3_path, df)]
+# Reads start while the prefix is still being listed
+def read_parquet_all(s3_prefix, columns=None, filters=None, workers=TRANSFER_WORKERS):
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            path: pool.submit(read_parquet, path, columns=columns, filters=filters, size=entry["size"])
+            for path, entry in stream_manifest(s3_prefix) if path.endswith(".parquet")
+        }
+        return [(path, futures[path].result()) for path in tqdm(sorted(futures))]
+
+
+# Local cache management
+# LOCAL_PATH mirrors whatever each stage downloads or produces, so we track access times and
+# evict least recently used files once it grows past CACHE_BUDGET. Only files that are safely
+# in S3 are ever evicted, anything only on local disk is kept.
+
+def cache_db():
+    CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(CACHE_DB_PATH, timeout=60)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS access (key TEXT PRIMARY KEY, atime REAL, hits INTEGER, misses INTEGER)")
+    db.execute("CREATE TABLE IF NOT EXISTS pins (key TEXT, pid INTEGER)")
+    return db
+
+# Mark files as just used, hit=True/False also counts towards the hit rate
+def record_access(s3_paths, hit=None):
+    now = time.time()
+    rows = [(str(path), now, int(hit is True), int(hit is False)) for path in s3_paths]
+    if not rows:
+        return
+    with closing(cache_db()) as db, db:
+        db.executemany(
+            "INSERT INTO access VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+            "atime = excluded.atime, hits = hits + excluded.hits, misses = misses + excluded.misses",
+            rows,
+        )
+
+# Files in use (being transferred or read) are pinned and never evicted, even by other processes
+@contextmanager
+def pinned(*s3_paths):
+    rows = [(str(path), os.getpid()) for path in s3_paths]
+    with closing(cache_db()) as db, db:
+        db.executemany("INSERT INTO pins VALUES (?, ?)", rows)
+    try:
+        yield
+    finally:
+        with closing(cache_db()) as db, db:
+            db.executemany(
+                "DELETE FROM pins WHERE rowid = (SELECT rowid FROM pins WHERE key = ? AND pid = ? LIMIT 1)",
+                rows,
+            )
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Pinned keys, ignoring pins left behind by processes that have died
+def pinned_keys():
+    with closing(cache_db()) as db:
+        pins = db.execute("SELECT DISTINCT key, pid FROM pins").fetchall()
+    return {key for key, pid in pins if pid_alive(pid)}
+
+# key -> (size, mtime) for every file in LOCAL_PATH
+def local_cache_files():
+    files = {}
+    for local_path in LOCAL_PATH.rglob("*"):
+        if local_path.is_file():
+            stat = local_path.stat()
+            files[str(local_path.relative_to(LOCAL_PATH))] = (stat.st_size, stat.st_mtime)
+    return files
+
+# Every saved manifest merged together
+def load_all_manifests():
+    remote = {}
+    for path in MANIFEST_PATH.glob("*.json"):
+        with open(path) as f:
+            remote.update(json.load(f))
+    return remote
+
+# Whether a saved manifest has a remote copy matching the local file, so deleting it loses nothing
+# Files no manifest knows about are kept rather than checked one HEAD at a time
+def exists_remotely(key, size, remote):
+    return key in remote and remote[key]["size"] == size
+
+# Delete least recently used files until LOCAL_PATH fits in budget bytes, returns bytes freed
+# Files in keep or under keep_prefix, pinned files and files not (identically) in S3 are skipped
+def evict(budget=CACHE_BUDGET, keep=(), keep_prefix=None):
+    files = local_cache_files()
+    used = sum(size for size, _ in files.values())
+    if used <= budget:
+        return 0
+
+    with closing(cache_db()) as db:
+        atimes = dict(db.execute("SELECT key, atime FROM access"))
+    keep = set(keep) | pinned_keys()
+    remote = load_all_manifests()
+
+    freed = 0
+    evicted = 0
+    # Files we've never tracked fall back to their mtime
+    for key in sorted(files, key=lambda k: atimes.get(k, files[k][1])):
+        if used - freed <= budget:
+            break
+        size = files[key][0]
+        if key in keep or (keep_prefix and key.startswith(str(keep_prefix))) or not exists_remotely(key, size, remote):
+            continue
+        s3_to_local_path(key).unlink(missing_ok=True)
+        freed += size
+        evicted += 1
+
+    print(f"Evicted {evicted} files ({freed / 1024 ** 3:.2f} GB), cache is {(used - freed) / 1024 ** 3:.2f} GB of {budget / 1024 ** 3:.2f} GB")
+    return freed
+
+# Usage and hit rate for each directory in the cache
+def cache_report():
+    files = local_cache_files()
+    with closing(cache_db()) as db:
+        counts = {key: (hits, misses) for key, hits, misses in db.execute("SELECT key, hits, misses FROM access")}
+
+    rows = {}
+    for key in set(files) | set(counts):
+        prefix = str(Path(key).parent)
+        row = rows.setdefault(prefix, {"files": 0, "bytes": 0, "hits": 0, "misses": 0})
+        if key in files:
+            row["files"] += 1
+            row["bytes"] += files[key][0]
+        hits, misses = counts.get(key, (0, 0))
+        row["hits"] += hits
+        row["misses"] += misses
+
+    report = pd.DataFrame.from_dict(rows, orient="index").sort_values("bytes", ascending=False)
+    report["gb"] = report.bytes / 1024 ** 3
+    report["hit_rate"] = report.hits / (report.hits + report.misses)
+    return report[["files", "gb", "hits", "misses", "hit_rate"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local S3 cache in " + str(LOCAL_PATH))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("cache", help="Report cache usage and hit rate per prefix")
+    evict_parser = subparsers.add_parser("evict", help="Evict least recently used files down to the budget")
+    evict_parser.add_argument("--budget-gb", type=float, default=CACHE_BUDGET / 1024 ** 3)
+    args = parser.parse_args()
+
+    if args.command == "cache":
+        report = cache_report()
+        pd.set_option("display.max_rows", None)
+        print(report.to_string(float_format="{:.2f}".format))
+        total_hits, total_misses = report.hits.sum(), report.misses.sum()
+        print(f"\nTotal {report.gb.sum():.2f} GB of {CACHE_BUDGET / 1024 ** 3:.2f} GB budget, "
+              f"hit rate {total_hits / max(total_hits + total_misses, 1):.1%}")
+    elif args.command == "evict":
+        evict(int(args.budget_gb * 1024 ** 3))
@@ -0,0 +1,70 @@
+import sys
+import os
+import shutil
+import time
+scripts_folder = os.path.join(os.getcwd(), 'Scripts')
+sys.path.append(scripts_folder)
+from s3 import *
+
+"""
+Benchmark upload_all/download_all throughput for different worker counts.
+Writes random files under benchmark/, syncs them up and back down, then removes them from the bucket.
+
+Point S3_ENDPOINT in Scripts/.env at a local S3 stand-in (e.g. `moto_server -p 5000` or MinIO)
+so the numbers measure our transfer code rather than the network.
+
+USAGE:
+python3 Scripts/s3_benchmark.py <num_files> <file_size_mb> <workers,workers,...>
+
+e.g. python3 Scripts/s3_benchmark.py 200 8 1,4,16
+"""
+
+PREFIX = "benchmark/"
+
+
+def make_files(num_files, file_size_mb):
+    local_prefix = s3_to_local_path(PREFIX)
+    shutil.rmtree(local_prefix, ignore_errors=True)
+    local_prefix.mkdir(parents=True, exist_ok=True)
+    for i in range(num_files):
+        with open(local_prefix / f"{i:05d}.bin", "wb") as f:
+            f.write(os.urandom(int(file_size_mb * 1024 * 1024)))
+
+
+def clear_remote():
+    for path in s3_list(PREFIX):
+        s3.delete_object(Bucket=BUCKET, Key=path)
+
+
+def benchmark(num_files, file_size_mb, worker_counts):
+    total_mb = num_files * file_size_mb
+    results = []
+    for workers in worker_counts:
+        make_files(num_files, file_size_mb)
+        clear_remote()
+
+        start = time.time()
+        upload_all(PREFIX, workers=workers)
+        upload_secs = time.time() - start
+
+        shutil.rmtree(s3_to_local_path(PREFIX))
+        start = time.time()
+        download_all(PREFIX, overwrite=True, workers=workers)
+        download_secs = time.time() - start
+
+        results.append((workers, total_mb / upload_secs, total_mb / download_secs))
+
+    clear_remote()
+    shutil.rmtree(s3_to_local_path(PREFIX), ignore_errors=True)
+
+    print(f"{num_files} files x {file_size_mb} MB")
+    print(f"{'workers':>8} {'upload MB/s':>12} {'download MB/s':>14}")
+    for workers, up, down in results:
+        print(f"{workers:>8} {up:>12.1f} {down:>14.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python3 Scripts/s3_benchmark.py <num_files> <file_size_mb> <workers,workers,...>")
+        sys.exit(1)
+    benchmark(int(sys.argv[1]), float(sys.argv[2]), [int(w) for w in sys.argv[3].split(",")])
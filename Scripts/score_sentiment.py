@@ -0,0 +1,267 @@
+import sys, os
+scripts_folder = os.path.join(os.getcwd(), 'Scripts')
+sys.path.append(scripts_folder)
+import argparse
+import json
+import shutil
+import time
+import multiprocessing
+import torch
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from tqdm import tqdm
+from s3 import *
+from sentiment import BACKENDS, CHUNKING_POLICIES, MODEL, SCORE_COLUMNS, Scorer
+from sentiment_cache import SentimentCache
+from sentiment_cascade import CALIBRATION_PATH, Cascade
+from near_duplicates import THRESHOLD, NearDuplicates
+
+"""
+Score every artifact under a prefix with RoBERTa, writing the same twitter_roberta outputs as
+SentimentAnalysis/pipeline.ipynb (artifacts -> twitter_roberta in the path, artifact columns plus SCORE_COLUMNS).
+
+Artifacts are streamed through in batches of rows, so memory is bounded by the batch size rather than the
+artifact. Each scored batch is checkpointed to ~/s3local/checkpoints/, and a rerun after a crash carries on
+from the last checkpoint. Once every batch of an artifact is scored they're stitched into its output, which
+is uploaded in the background while the next artifact is scored. Each output records the version (ETag and row
+count) of the artifact it was scored from, and artifacts with an output from their current version are skipped.
+Artifacts that have grown since (splitting merges new rows into them) are scored again, mostly from the cache.
+
+With --workers K, artifacts are handed out largest first to K processes, each with its own copy of the model
+on CPU and torch limited to --threads threads (by default the cores split evenly between workers). One torch
+process scales poorly past a few cores, several smaller ones scale close to linearly.
+
+With --cascade, texts VADER is confident about are scored from the lexicon and only the rest go to RoBERTa
+(see sentiment_cascade.py, which must be calibrated first). Outputs get a sentiment_source column saying which.
+
+With --near-duplicates, near-identical texts within an artifact (e.g. syndicated news) are clustered and only one
+per cluster is scored, the rest get its scores (see near_duplicates.py).
+
+USAGE:
+    python3 Scripts/score_sentiment.py processed/news/gnews_artifacts/
+    python3 Scripts/score_sentiment.py processed/reddit/comments_artifacts/ --batch-rows 512 --no-cache
+    python3 Scripts/score_sentiment.py processed/news/gnews_artifacts/ --workers 8 --threads 4 --backend onnx
+    python3 Scripts/score_sentiment.py processed/reddit/comments_artifacts/ --cascade
+    python3 Scripts/score_sentiment.py processed/news/gnews_artifacts/ --chunking windows --max-chunks 8
+    python3 Scripts/score_sentiment.py processed/news/gnews_artifacts/ --near-duplicates
+"""
+
+# Rows per scored (and checkpointed) batch
+BATCH_ROWS = 1024
+CHECKPOINT_PATH = Path.home() / "s3local" / "checkpoints" / BUCKET
+# Parquet metadata key of the artifact version an output was scored from
+SOURCE_KEY = b"sentiment_source_artifact"
+
+# Scorer, cache, cascade and near-duplicate collapse of a worker process, set up once by init_worker
+worker = {}
+
+
+def output_path(artifact_path):
+    # Assumes that there is 'artifacts' in input path
+    return Path(str(artifact_path).replace("artifacts", "twitter_roberta"))
+
+
+def checkpoint_dir(artifact_path):
+    return CHECKPOINT_PATH / local_to_s3_path(output_path(artifact_path))
+
+
+# Artifact columns plus the scores (and where they came from when cascading)
+def output_schema(artifact_schema, cascade=False):
+    for column in SCORE_COLUMNS:
+        artifact_schema = artifact_schema.append(pa.field(column, pa.float64()))
+    if cascade:
+        artifact_schema = artifact_schema.append(pa.field("sentiment_source", pa.string()))
+    return artifact_schema
+
+
+# {"etag", "rows"} of the artifact an output (local, or else in S3) was scored from, None if it predates them
+def read_source(out_s3_path, size=None):
+    local_path = s3_to_local_path(out_s3_path)
+    if local_path.is_file():
+        metadata = pq.read_schema(local_path).metadata
+    else:
+        with s3_open(out_s3_path, size=size) as f:
+            metadata = pq.read_schema(f).metadata
+    source = (metadata or {}).get(SOURCE_KEY)
+    return json.loads(source) if source else None
+
+
+# Score a batch of artifact rows, returns a table with SCORE_COLUMNS (and sentiment_source when cascading) appended
+def score_batch(batch, scorer, cache=None, cascade=None, near_duplicates=None):
+    texts = [text or "" for text in batch.column("text").to_pylist()]
+    if cascade:
+        scores, sources = cascade.score_with_source(texts)
+    elif near_duplicates:
+        scores = near_duplicates.score(texts)
+    else:
+        scores = cache.score(texts, scorer) if cache else scorer.score(texts)
+    table = pa.Table.from_batches([batch])
+    for i, column in enumerate(SCORE_COLUMNS):
+        table = table.append_column(column, pa.array(scores[:, i], pa.float64()))
+    if cascade:
+        table = table.append_column("sentiment_source", pa.array(sources.tolist(), pa.string()))
+    return table
+
+
+# Score one local artifact, resuming from its checkpoints if it was interrupted, returns the output path
+# etag is the artifact's S3 ETag, recorded in the output with its row count so changed artifacts are rescored
+def score_artifact(artifact_path, scorer, cache=None, batch_rows=BATCH_ROWS, cascade=None, near_duplicates=None, etag=None):
+    artifact_path, out_path = Path(artifact_path), output_path(artifact_path)
+    parts = checkpoint_dir(artifact_path)
+
+    # Checkpoints only line up with the artifact and batch size they were made from
+    stat = artifact_path.stat()
+    state = {"size": stat.st_size, "mtime": stat.st_mtime, "batch_rows": batch_rows, "model": (cascade or near_duplicates or scorer).model_id}
+    state_path = parts / "state.json"
+    if not state_path.exists() or json.loads(state_path.read_text()) != state:
+        shutil.rmtree(parts, ignore_errors=True)
+        parts.mkdir(parents=True)
+        state_path.write_text(json.dumps(state))
+
+    parquet_file = pq.ParquetFile(artifact_path)
+    schema = output_schema(parquet_file.schema_arrow, cascade is not None)
+    part_paths = []
+    # Near-duplicates are collapsed within an artifact
+    if near_duplicates:
+        near_duplicates.reset()
+    for i, batch in enumerate(parquet_file.iter_batches(batch_size=batch_rows)):
+        part_path = parts / f"{i:06d}.parquet"
+        part_paths.append(part_path)
+        if part_path.exists():
+            if near_duplicates:
+                part = pq.read_table(part_path, columns=["text", *SCORE_COLUMNS])
+                near_duplicates.add([text or "" for text in part.column("text").to_pylist()], part.select(SCORE_COLUMNS).to_pandas().to_numpy())
+            continue
+        tmp_path = part_path.with_name(part_path.name + ".tmp")
+        pq.write_table(score_batch(batch, scorer, cache, cascade, near_duplicates).cast(schema), tmp_path)
+        os.replace(tmp_path, part_path)
+
+    # Stitch the checkpoints together a batch at a time
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = parts / "output.parquet.tmp"
+    source = json.dumps({"etag": etag, "rows": parquet_file.metadata.num_rows}).encode()
+    with pq.ParquetWriter(tmp_path, schema.with_metadata({**(schema.metadata or {}), SOURCE_KEY: source})) as writer:
+        for part_path in part_paths:
+            writer.write_table(pq.read_table(part_path, schema=schema))
+    os.replace(tmp_path, out_path)
+    shutil.rmtree(parts)
+    return out_path
+
+
+# Download the artifacts under a prefix without an output from their current version, returns [(local path, etag)]
+# Outputs evicted from the local cache still count, their footers are read from S3
+def pending_artifacts(artifacts_prefix, workers=TRANSFER_WORKERS):
+    outputs_prefix = artifacts_prefix.replace("artifacts", "twitter_roberta")
+    outputs = refresh_manifest(outputs_prefix)
+    for path in s3_to_local_path(outputs_prefix).glob("*.parquet"):
+        outputs.setdefault(local_to_s3_path(path), None)
+    artifacts = {path: entry for path, entry in refresh_manifest(artifacts_prefix).items() if path.endswith(".parquet")}
+
+    scored = {path: str(output_path(path)) for path in artifacts if str(output_path(path)) in outputs}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {path: pool.submit(read_source, out_path, (outputs[out_path] or {}).get("size")) for path, out_path in scored.items()}
+        sources = {path: future.result() for path, future in futures.items()}
+    pending = {path for path, entry in artifacts.items() if (sources.get(path) or {}).get("etag") != entry["etag"]}
+    print(f"Scoring {len(pending)} of {len(artifacts)} artifacts ({sum(path in scored for path in pending)} changed since they were scored)")
+
+    download_all(artifacts_prefix, include=lambda path: path in pending)
+    artifacts = load_manifest(artifacts_prefix)
+    return [(s3_to_local_path(path), artifacts.get(path, {}).get("etag")) for path in sorted(pending)]
+
+
+# Score every artifact under a prefix without an output from its current version, uploading outputs as they're finished
+def score_prefix(artifacts_prefix, scorer, cache=None, batch_rows=BATCH_ROWS, cascade=None, near_duplicates=None):
+    pending = pending_artifacts(artifacts_prefix)
+
+    with UploadQueue() as uploads:
+        for artifact_path, etag in tqdm(pending):
+            out_path = score_artifact(artifact_path, scorer, cache, batch_rows, cascade, near_duplicates, etag)
+            uploads.put(local_to_s3_path(out_path))
+    if cache:
+        print(f"Sentiment cache: {cache.hits} hits, {cache.misses} misses")
+    if near_duplicates:
+        print(f"Near-duplicates: {near_duplicates.duplicates} texts given a representative's scores, {near_duplicates.scored} scored")
+
+    # Catch anything the background uploads missed
+    upload_all(artifacts_prefix.replace("artifacts", "twitter_roberta"), overwrite=False)
+
+
+def init_worker(model, backend, threads, use_cache, calibration_path=None, chunking="overlap", max_chunks=None, near_duplicate_threshold=None):
+    torch.set_num_threads(threads)
+    worker["scorer"] = Scorer(model, device=torch.device("cpu"), backend=backend, chunking=chunking, max_chunks=max_chunks)
+    worker["cache"] = SentimentCache() if use_cache else None
+    worker["cascade"] = Cascade(worker["scorer"], calibration_path, worker["cache"]) if calibration_path else None
+    worker["near_duplicates"] = NearDuplicates(worker["scorer"], worker["cache"], near_duplicate_threshold) if near_duplicate_threshold else None
+
+
+# Runs in a worker process, returns (worker pid, output path, rows, seconds)
+def score_artifact_in_worker(artifact_path, batch_rows, etag=None):
+    start = time.time()
+    out_path = score_artifact(artifact_path, worker["scorer"], worker["cache"], batch_rows, worker["cascade"], worker["near_duplicates"], etag)
+    return os.getpid(), out_path, pq.ParquetFile(out_path).metadata.num_rows, time.time() - start
+
+
+# score_prefix over a pool of worker processes, each with its own model copy and thread budget
+def score_prefix_parallel(artifacts_prefix, model=MODEL, backend="torch", workers=2, threads=None, use_cache=True, batch_rows=BATCH_ROWS, calibration_path=None,
+                          chunking="overlap", max_chunks=None, near_duplicate_threshold=None):
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    pending = sorted(pending_artifacts(artifacts_prefix), key=lambda artifact: artifact[0].stat().st_size, reverse=True)
+    print(f"{workers} workers x {threads} threads")
+
+    # {worker pid: [docs, seconds]}
+    stats = {}
+    start = time.time()
+    # Spawn rather than fork, torch's thread pools don't survive a fork
+    context = multiprocessing.get_context("spawn")
+    with UploadQueue() as uploads, ProcessPoolExecutor(workers, context, init_worker, (model, backend, threads, use_cache, calibration_path, chunking, max_chunks, near_duplicate_threshold)) as pool:
+        futures = [pool.submit(score_artifact_in_worker, path, batch_rows, etag) for path, etag in pending]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            pid, out_path, rows, seconds = future.result()
+            uploads.put(local_to_s3_path(out_path))
+            worker_stats = stats.setdefault(pid, [0, 0.0])
+            worker_stats[0] += rows
+            worker_stats[1] += seconds
+            tqdm.write(f"{out_path.name}: {rows} docs in {seconds:.0f}s ({rows / max(seconds, 1e-6):.1f} docs/s) on worker {pid}")
+
+    elapsed = time.time() - start
+    for pid, (docs, seconds) in sorted(stats.items()):
+        print(f"Worker {pid}: {docs} docs in {seconds:.0f}s busy ({docs / max(seconds, 1e-6):.1f} docs/s)")
+    total_docs = sum(docs for docs, _ in stats.values())
+    print(f"Total: {total_docs} docs in {elapsed:.0f}s ({total_docs / max(elapsed, 1e-6):.1f} docs/s)")
+
+    # Catch anything the background uploads missed
+    upload_all(artifacts_prefix.replace("artifacts", "twitter_roberta"), overwrite=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score artifacts with RoBERTa sentiment, resuming from checkpoints")
+    parser.add_argument("prefix", help="S3 prefix of the artifacts, e.g. processed/news/gnews_artifacts/")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS, help="Rows scored and checkpointed at a time")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--backend", default="torch", choices=BACKENDS, help="int8 and onnx run on CPU, see sentiment.py")
+    parser.add_argument("--no-cache", action="store_true", help="Don't look up or store scores in the sentiment cache")
+    parser.add_argument("--workers", type=int, default=1, help="Scoring processes, each with its own model on CPU")
+    parser.add_argument("--threads", type=int, default=None, help="Torch threads per worker, defaults to cores / workers")
+    parser.add_argument("--cascade", nargs="?", const=CALIBRATION_PATH, type=Path, default=None, metavar="CALIBRATION",
+                        help="Score confident texts with VADER, the rest with RoBERTa, see sentiment_cascade.py")
+    parser.add_argument("--chunking", default="overlap", choices=CHUNKING_POLICIES, help="How long texts are chunked, see sentiment.py")
+    parser.add_argument("--max-chunks", type=int, default=None, help="Cap on chunks per text, keeping evenly spaced ones")
+    parser.add_argument("--near-duplicates", nargs="?", const=THRESHOLD, type=float, default=None, metavar="THRESHOLD",
+                        help="Only score one of each cluster of near-identical texts, see near_duplicates.py")
+    args = parser.parse_args()
+    if args.cascade and args.near_duplicates:
+        parser.error("--cascade and --near-duplicates can't be combined")
+
+    if args.workers > 1:
+        score_prefix_parallel(args.prefix, args.model, args.backend, args.workers, args.threads, not args.no_cache, args.batch_rows, args.cascade,
+                              args.chunking, args.max_chunks, args.near_duplicates)
+    else:
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        scorer = Scorer(args.model, backend=args.backend, chunking=args.chunking, max_chunks=args.max_chunks)
+        cache = None if args.no_cache else SentimentCache()
+        cascade = Cascade(scorer, args.cascade, cache) if args.cascade else None
+        near_duplicates = NearDuplicates(scorer, cache, args.near_duplicates) if args.near_duplicates else None
+        score_prefix(args.prefix, scorer, cache, args.batch_rows, cascade, near_duplicates)
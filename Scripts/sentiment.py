@@ -0,0 +1,314 @@
+import argparse
+import glob
+import os
+import random
+import time
+import numpy as np
+import pandas as pd
+import torch
+from pathlib import Path
+from transformers import AutoTokenizer
+from transformers import AutoModelForSequenceClassification
+
+"""
+RoBERTa sentiment scoring, shared by SentimentAnalysis/pipeline.ipynb and the sentiment scripts.
+
+    scorer = Scorer()
+    scorer.analyse_large_text("GameStop shares rose")    # {'roberta_pos': ..., 'roberta_normalised_compound': ...}
+    scorer.score(texts)                                  # [len(texts), 5] array in SCORE_COLUMNS order
+
+Texts longer than the model's 512 token limit are scored in chunks and averaged, weighted by chunk length.
+Chunks are cut straight from the token ids, and chunks from every text passed to score() are sorted by length
+and run BATCH_SIZE at a time, padded only to the longest chunk in each batch.
+
+How long texts are chunked is one of CHUNKING_POLICIES:
+    overlap     512 token windows every 256 tokens, each token is scored about twice (the default)
+    windows     back to back 512 token windows, each token is scored once
+    head_tail   a single chunk of the first HEAD_TOKENS and last tokens of the text
+max_chunks caps the chunks per text for overlap and windows, keeping evenly spaced ones.
+
+The model can run on one of BACKENDS (CPU only apart from torch):
+    torch   fp32 PyTorch, as the model is published
+    int8    PyTorch with Linear layers dynamically quantized to int8
+    onnx    ONNX Runtime, the model is exported once to ~/s3local/cache/onnx/
+
+USAGE:
+    python3 Scripts/sentiment.py agreement [--backends int8,onnx] [--model <model>]
+        Score SentimentAnalysis/sample_news with each backend, report speed and agreement against fp32 torch.
+
+    python3 Scripts/sentiment.py chunking <artifacts_prefix> [--policies windows,head_tail,overlap:max4] [--rows 2000]
+        Score a sample of artifact texts with each chunking policy, report model tokens and drift against overlap.
+"""
+
+MODEL = "cardiffnlp/twitter-roberta-base-sentiment-latest"
+# Columns added to each artifact, in the order Scorer.score returns them
+SCORE_COLUMNS = ['roberta_pos', 'roberta_neu', 'roberta_neg', 'roberta_compound', 'roberta_normalised_compound']
+# Tokens per chunk, the model's limit
+CHUNK_SIZE = 512
+# Tokens between chunk starts, chunks overlap to avoid missing context between them
+CHUNK_STRIDE = 256
+# Chunks per forward pass
+BATCH_SIZE = 32
+CHUNKING_POLICIES = ["overlap", "windows", "head_tail"]
+# Tokens from the start of a text in its head_tail chunk, the rest come from the end
+HEAD_TOKENS = 128
+BACKENDS = ["torch", "int8", "onnx"]
+ONNX_PATH = Path.home() / "s3local" / "cache" / "onnx"
+SAMPLE_NEWS_PATH = Path(__file__).parent.parent / "SentimentAnalysis" / "sample_news"
+
+
+# GPU if there is one
+def default_device():
+    if torch.cuda.is_available():
+        print("Using GPU:", torch.cuda.get_device_name(0))
+        return torch.device("cuda")
+    print("Using CPU")
+    return torch.device("cpu")
+
+
+# Export a model to ONNX (once) and open it with ONNX Runtime, using as many threads as torch is set to
+def onnx_session(model, torch_model, pad_token_id):
+    # Only needed for the onnx backend
+    import onnxruntime
+
+    path = ONNX_PATH / (model.strip("/").replace("/", "--") + ".onnx")
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Example batch with some padding, sizes are dynamic in the exported graph
+        input_ids = torch.full((2, 16), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((2, 16), dtype=torch.long)
+        input_ids[0, :], attention_mask[0, :] = 3, 1
+        input_ids[1, :8], attention_mask[1, :8] = 3, 1
+        # Several workers may export at once, each writes its own copy
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        torch.onnx.export(
+            torch_model, (input_ids, attention_mask), str(tmp_path),
+            input_names=["input_ids", "attention_mask"], output_names=["logits"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"}, "logits": {0: "batch"}},
+            opset_version=17, dynamo=False,
+        )
+        os.replace(tmp_path, path)
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = torch.get_num_threads()
+    return onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+class Scorer:
+    def __init__(self, model=MODEL, device=None, batch_size=BATCH_SIZE, backend="torch", stride=CHUNK_STRIDE, chunking="overlap", max_chunks=None):
+        if backend not in BACKENDS:
+            raise Exception(f"Unknown backend {backend}, expected one of {BACKENDS}")
+        if chunking not in CHUNKING_POLICIES:
+            raise Exception(f"Unknown chunking policy {chunking}, expected one of {CHUNKING_POLICIES}")
+        # Identifies the scores this produces, e.g. in the sentiment cache
+        self.model_id = model if backend == "torch" else f"{model}:{backend}"
+        # Only overlap chunks by the stride, the other policies give the same scores whatever it is
+        if chunking == "overlap" and stride != CHUNK_STRIDE:
+            self.model_id += f":stride{stride}"
+        if chunking != "overlap":
+            self.model_id += f":{chunking}"
+        if max_chunks:
+            self.model_id += f":max{max_chunks}"
+        self.backend = backend
+        self.stride = stride
+        self.chunking = chunking
+        self.max_chunks = max_chunks
+        # Chunks and tokens (excluding padding) run through the model so far
+        self.chunks = 0
+        self.tokens = 0
+        # Quantized and ONNX models only run on CPU
+        self.device = torch.device("cpu") if backend != "torch" else (device or default_device())
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model).to(self.device).eval()
+        if backend == "int8":
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif backend == "onnx":
+            self.session = onnx_session(model, self.model, self.tokenizer.pad_token_id)
+
+    # Chunks of one text's token ids following the chunking policy, as (model input ids, weight)
+    # Roberta can do 512 tokens at max including the start/end tokens. For overlap, the last couple of tokens of a
+    # full chunk are dropped, but the chunk is still weighted by its full length (as when chunks were re-tokenized)
+    def chunk(self, tokens):
+        # Empty texts have no chunks under any policy, so no model call is spent on them
+        if not tokens:
+            return []
+        content_size = CHUNK_SIZE - 2
+        if self.chunking == "head_tail":
+            spans = [tokens if len(tokens) <= content_size else tokens[:HEAD_TOKENS] + tokens[HEAD_TOKENS - content_size:]]
+        elif self.chunking == "windows":
+            spans = [tokens[i:i + content_size] for i in range(0, len(tokens), content_size)]
+        else:
+            spans = [tokens[i:i + CHUNK_SIZE] for i in range(0, len(tokens), self.stride)]
+        if self.max_chunks and len(spans) > self.max_chunks:
+            spans = [spans[i] for i in np.linspace(0, len(spans) - 1, self.max_chunks).round().astype(int)]
+        return [([self.tokenizer.cls_token_id] + span[:content_size] + [self.tokenizer.sep_token_id], len(span)) for span in spans]
+
+    # Logits for each list of input ids, run in batches of similar length so there's little padding
+    def forward(self, inputs):
+        logits = np.zeros((len(inputs), self.model.config.num_labels))
+        self.chunks += len(inputs)
+        self.tokens += sum(map(len, inputs))
+        order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]), reverse=True)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                longest = len(inputs[batch[0]])
+                input_ids = torch.full((len(batch), longest), self.tokenizer.pad_token_id, dtype=torch.long)
+                attention_mask = torch.zeros((len(batch), longest), dtype=torch.long)
+                for row, i in enumerate(batch):
+                    input_ids[row, :len(inputs[i])] = torch.tensor(inputs[i])
+                    attention_mask[row, :len(inputs[i])] = 1
+                if self.backend == "onnx":
+                    logits[batch] = self.session.run(["logits"], {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()})[0]
+                else:
+                    output = self.model(input_ids=input_ids.to(self.device), attention_mask=attention_mask.to(self.device))
+                    logits[batch] = output.logits.float().cpu().numpy()
+        return logits
+
+    # Scores for a list of texts, one row per text in SCORE_COLUMNS order
+    # Chunks from all the texts are batched together, then each text's chunk scores are averaged weighted by chunk length
+    # Empty and whitespace-only texts have no chunks and get NaN scores
+    def score(self, texts):
+        texts = list(texts)
+        tokens = self.tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]
+        tokens = [text_tokens if text.strip() else [] for text, text_tokens in zip(texts, tokens)]
+        documents, inputs, weights = [], [], []
+        for document, text_tokens in enumerate(tokens):
+            for input_ids, weight in self.chunk(text_tokens):
+                documents.append(document)
+                inputs.append(input_ids)
+                weights.append(weight)
+        logits = self.forward(inputs)
+
+        # Weighted average of scores by chunk length
+        documents = np.array(documents, dtype=np.int64)
+        weighted_scores = np.zeros((len(tokens), logits.shape[1]))
+        total_weights = np.zeros(len(tokens))
+        np.add.at(weighted_scores, documents, logits * np.array(weights, dtype=np.float64)[:, None])
+        np.add.at(total_weights, documents, weights)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weighted_scores /= total_weights[:, None]
+        compound_score = weighted_scores[:, 2] - weighted_scores[:, 0]
+        normalised_compound = compound_score / np.sqrt(compound_score**2 + 20)
+
+        return np.column_stack([
+            weighted_scores[:, 2],
+            weighted_scores[:, 1],
+            weighted_scores[:, 0],
+            compound_score,
+            normalised_compound,
+        ])
+
+    # Scores for a single text as {column: score}
+    def analyse_large_text(self, text):
+        return dict(zip(SCORE_COLUMNS, self.score([text])[0]))
+
+
+# Title and body of every sample article
+def sample_news_texts():
+    texts = []
+    for path in sorted(glob.glob(str(SAMPLE_NEWS_PATH / "*.csv"))):
+        df = pd.read_csv(path)
+        texts += (df["Title"].fillna("") + "\n" + df["Content"].fillna("")).tolist()
+    return texts
+
+
+# Up to rows non-empty texts from artifacts under an S3 prefix, reading only the text column of randomly chosen files
+def sample_artifact_texts(artifacts_prefix, rows, seed=0):
+    # Only needed for artifact samples, s3 needs a .env
+    from s3 import read_parquet, s3_list
+
+    paths = [path for path in s3_list(artifacts_prefix) if path.endswith(".parquet")]
+    random.Random(seed).shuffle(paths)
+    texts = []
+    for path in paths:
+        texts += [text for text in read_parquet(path, columns=["text"])["text"].tolist() if text]
+        if len(texts) >= rows:
+            break
+    return random.Random(seed).sample(texts, min(rows, len(texts)))
+
+
+# Score the sample news with each backend and compare against fp32 torch on CPU
+def agreement_report(model=MODEL, backends=("int8", "onnx"), batch_size=BATCH_SIZE):
+    texts = sample_news_texts()
+    results = {}
+    for backend in ["torch", *backends]:
+        scorer = Scorer(model, torch.device("cpu"), batch_size, backend)
+        # Warm up (and export the ONNX model) before timing
+        scorer.score(texts[:2])
+        start = time.time()
+        results[backend] = (scorer.score(texts), time.time() - start)
+
+    baseline, baseline_seconds = results["torch"]
+    compound = SCORE_COLUMNS.index("roberta_normalised_compound")
+    # Labels in the order of the model's classes (neg, neu, pos)
+    baseline_labels = np.argmax(baseline[:, [2, 1, 0]], axis=1)
+    rows = []
+    for backend, (scores, seconds) in results.items():
+        delta = np.abs(scores[:, compound] - baseline[:, compound])
+        rows.append({
+            "backend": backend,
+            "docs/s": len(texts) / seconds,
+            "speedup": baseline_seconds / seconds,
+            "label agreement": np.mean(np.argmax(scores[:, [2, 1, 0]], axis=1) == baseline_labels),
+            "compound corr": np.corrcoef(scores[:, compound], baseline[:, compound])[0, 1],
+            "compound mean |delta|": delta.mean(),
+            "compound max |delta|": delta.max(),
+        })
+    print(f"{len(texts)} sample news articles, {torch.get_num_threads()} threads")
+    print(pd.DataFrame(rows).set_index("backend").to_string(float_format="{:.4f}".format))
+
+
+# Score a sample of artifact texts with each chunking policy ("policy" or "policy:maxN") and compare against overlap
+def chunking_report(artifacts_prefix, model=MODEL, policies=("windows", "head_tail", "overlap:max4"), rows=2000, batch_size=BATCH_SIZE):
+    texts = sample_artifact_texts(artifacts_prefix, rows)
+    report = []
+    baseline = None
+    for policy in ["overlap", *policies]:
+        chunking, _, max_chunks = policy.partition(":max")
+        scorer = Scorer(model, batch_size=batch_size, chunking=chunking, max_chunks=int(max_chunks) if max_chunks else None)
+        start = time.time()
+        scores = scorer.score(texts)
+        seconds = time.time() - start
+        if baseline is None:
+            baseline, baseline_tokens = scores, scorer.tokens
+
+        compound = SCORE_COLUMNS.index("roberta_normalised_compound")
+        delta = np.abs(scores[:, compound] - baseline[:, compound])
+        report.append({
+            "policy": policy,
+            "chunks": scorer.chunks,
+            "tokens": scorer.tokens,
+            "token share": scorer.tokens / max(baseline_tokens, 1),
+            "docs/s": len(texts) / seconds,
+            "label agreement": np.mean(np.argmax(scores[:, [2, 1, 0]], axis=1) == np.argmax(baseline[:, [2, 1, 0]], axis=1)),
+            "compound corr": np.corrcoef(scores[:, compound], baseline[:, compound])[0, 1],
+            "compound mean |delta|": np.nanmean(delta),
+            "compound max |delta|": np.nanmax(delta),
+        })
+    lengths = [len(text.split()) for text in texts]
+    print(f"{len(texts)} texts from {artifacts_prefix}, median {np.median(lengths):.0f} words, {torch.get_num_threads()} threads")
+    print(pd.DataFrame(report).set_index("policy").to_string(float_format="{:.4f}".format))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RoBERTa sentiment scoring")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    agreement_parser = subparsers.add_parser("agreement", help="Compare backends against fp32 torch on the sample news")
+    agreement_parser.add_argument("--backends", default="int8,onnx")
+    agreement_parser.add_argument("--model", default=MODEL)
+    agreement_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    chunking_parser = subparsers.add_parser("chunking", help="Compare chunking policies against overlap on artifact texts")
+    chunking_parser.add_argument("prefix", help="S3 prefix of artifacts to sample texts from, e.g. processed/news/gnews_artifacts/")
+    chunking_parser.add_argument("--policies", default="windows,head_tail,overlap:max4,windows:max4",
+                                 help=f"Comma separated, each one of {CHUNKING_POLICIES} optionally with :maxN")
+    chunking_parser.add_argument("--rows", type=int, default=2000)
+    chunking_parser.add_argument("--model", default=MODEL)
+    chunking_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "agreement":
+        agreement_report(args.model, args.backends.split(","), args.batch_size)
+    elif args.command == "chunking":
+        chunking_report(args.prefix, args.model, args.policies.split(","), args.rows, args.batch_size)
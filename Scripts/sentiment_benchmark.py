@@ -0,0 +1,145 @@
+import os
+import argparse
+import datetime
+import itertools
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import subprocess
+import time
+import numpy as np
+import torch
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from sentiment import BACKENDS, BATCH_SIZE, CHUNK_STRIDE, MODEL, Scorer, sample_news_texts
+
+"""
+Benchmark sentiment scoring speed for different configurations (backend, batch size, chunk stride, threads).
+
+Scores SentimentAnalysis/sample_news plus synthetic long documents (sample articles joined end to end) with
+every combination of the given options, and reports docs/s, model tokens/s, p50/p99 latency per score() call and peak RSS.
+Each configuration runs in a fresh process so peak RSS and thread settings don't leak between them. Docs are
+scored --docs-per-call at a time and latency is timed per call, so it's per-doc latency only with --docs-per-call 1.
+
+Results are appended as JSON lines to --output (default SentimentAnalysis/benchmark_results.jsonl), one per
+configuration, with the time, commit and machine, so runs can be compared over time.
+
+USAGE:
+python3 Scripts/sentiment_benchmark.py [--backends torch,int8,onnx] [--batch-sizes 8,32] [--strides 256,512] [--threads 1,4]
+
+e.g. python3 Scripts/sentiment_benchmark.py --backends torch,onnx --threads 1,4 --long-docs 20
+"""
+
+RESULTS_PATH = Path(__file__).parent.parent / "SentimentAnalysis" / "benchmark_results.jsonl"
+
+
+# Sample articles joined together until each doc is at least long_words words
+def synthetic_long_docs(texts, count, long_words, seed=0):
+    rng = random.Random(seed)
+    docs = []
+    for _ in range(count):
+        parts = []
+        words = 0
+        while words < long_words:
+            text = rng.choice(texts)
+            parts.append(text)
+            words += len(text.split())
+        docs.append("\n\n".join(parts))
+    return docs
+
+
+def benchmark_texts(long_docs, long_words):
+    texts = sample_news_texts()
+    return texts + synthetic_long_docs(texts, long_docs, long_words)
+
+
+# Runs in a fresh process, scores texts with one configuration
+def run_config(model, texts, backend, batch_size, stride, threads, docs_per_call):
+    torch.set_num_threads(threads)
+    scorer = Scorer(model, torch.device("cpu"), batch_size, backend, stride)
+    # Warm up (and export the ONNX model) before timing
+    scorer.score(texts[:2])
+    scorer.chunks = scorer.tokens = 0
+
+    latencies = []
+    start = time.time()
+    for i in range(0, len(texts), docs_per_call):
+        call_start = time.time()
+        scorer.score(texts[i:i + docs_per_call])
+        latencies.append(time.time() - call_start)
+    seconds = time.time() - start
+
+    return {
+        "docs": len(texts),
+        "chunks": scorer.chunks,
+        "tokens": scorer.tokens,
+        "seconds": seconds,
+        "docs_per_second": len(texts) / seconds,
+        "tokens_per_second": scorer.tokens / seconds,
+        # Per score() call of docs_per_call docs
+        "p50_call_latency_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_call_latency_ms": float(np.percentile(latencies, 99) * 1000),
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError:
+        return ""
+
+
+def benchmark(model, backends, batch_sizes, strides, threads, docs_per_call, long_docs, long_words, output_path):
+    texts = benchmark_texts(long_docs, long_words)
+    run = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "model": model,
+        "docs_per_call": docs_per_call,
+        "long_docs": long_docs,
+        "long_words": long_words,
+    }
+    print(f"{len(texts)} docs ({long_docs} synthetic long docs of {long_words}+ words)")
+    print(f"Latency is per score() call of {docs_per_call} docs")
+    print(f"{'backend':>8} {'batch':>6} {'stride':>7} {'threads':>8} {'docs/s':>8} {'tokens/s':>9} {'p50 call ms':>12} {'p99 call ms':>12} {'peak MB':>8}")
+
+    context = multiprocessing.get_context("spawn")
+    with open(output_path, "a") as f:
+        for backend, batch_size, stride, thread_count in itertools.product(backends, batch_sizes, strides, threads):
+            config = {"backend": backend, "batch_size": batch_size, "stride": stride, "threads": thread_count}
+            with ProcessPoolExecutor(1, context) as pool:
+                result = pool.submit(run_config, model, texts, backend, batch_size, stride, thread_count, docs_per_call).result()
+            f.write(json.dumps({**run, **config, **result}) + "\n")
+            f.flush()
+            print(f"{backend:>8} {batch_size:>6} {stride:>7} {thread_count:>8} {result['docs_per_second']:>8.1f} {result['tokens_per_second']:>9.0f} "
+                  f"{result['p50_call_latency_ms']:>12.0f} {result['p99_call_latency_ms']:>12.0f} {result['peak_rss_mb']:>8.0f}")
+    print(f"Results appended to {output_path}")
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sentiment scoring configurations")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--backends", default="torch", type=lambda value: value.split(","))
+    parser.add_argument("--batch-sizes", default=str(BATCH_SIZE), type=int_list)
+    parser.add_argument("--strides", default=str(CHUNK_STRIDE), type=int_list)
+    parser.add_argument("--threads", default=str(torch.get_num_threads()), type=int_list)
+    parser.add_argument("--docs-per-call", type=int, default=64, help="Docs passed to each Scorer.score call, latency is timed per call (1 for per-doc latency)")
+    parser.add_argument("--long-docs", type=int, default=10, help="Synthetic long docs added to the sample news")
+    parser.add_argument("--long-words", type=int, default=3000, help="Minimum words per synthetic long doc")
+    parser.add_argument("--output", type=Path, default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        if backend not in BACKENDS:
+            parser.error(f"unknown backend {backend}, expected one of {BACKENDS}")
+    benchmark(args.model, args.backends, args.batch_sizes, args.strides, args.threads, args.docs_per_call, args.long_docs, args.long_words, args.output)
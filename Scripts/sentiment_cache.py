@@ -0,0 +1,92 @@
+import hashlib
+import re
+import sqlite3
+import unicodedata
+import numpy as np
+from pathlib import Path
+from sentiment import SCORE_COLUMNS
+
+"""
+Persistent content-addressed cache of sentiment scores, so text that's already been scored (the same article
+or post copied into several ticker artifacts, or a rerun) costs a lookup instead of a forward pass.
+
+Scores are keyed by a hash of the normalised text plus the scorer's model_id, in an indexed SQLite table
+under ~/s3local/cache/. Texts that only differ in whitespace or unicode normal form share a score.
+
+    cache = SentimentCache()
+    scores = cache.score(df['text'].tolist(), scorer)    # only scores texts not seen before
+    print(cache.hits, cache.misses)
+"""
+
+SENTIMENT_CACHE_PATH = Path.home() / "s3local" / "cache" / "sentiment.sqlite"
+# SQLite's default limit on variables per query is 999
+LOOKUP_BATCH = 500
+
+
+def normalise_text(text):
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_hash(text):
+    return hashlib.blake2b(normalise_text(text).encode(), digest_size=16).digest()
+
+
+class SentimentCache:
+    def __init__(self, path=SENTIMENT_CACHE_PATH):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        # Lets several scoring processes read while one writes
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"""CREATE TABLE IF NOT EXISTS scores (
+            hash BLOB NOT NULL,
+            model TEXT NOT NULL,
+            {", ".join(f"{column} REAL" for column in SCORE_COLUMNS)},
+            PRIMARY KEY (hash, model)
+        ) WITHOUT ROWID""")
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    # {hash: scores} for the hashes already scored by model_id
+    def get(self, hashes, model_id):
+        hashes = list(hashes)
+        found = {}
+        for i in range(0, len(hashes), LOOKUP_BATCH):
+            batch = hashes[i:i + LOOKUP_BATCH]
+            rows = self.db.execute(
+                f"SELECT hash, {', '.join(SCORE_COLUMNS)} FROM scores WHERE model = ? AND hash IN ({', '.join('?' * len(batch))})",
+                [model_id, *batch],
+            )
+            for row in rows:
+                found[row[0]] = row[1:]
+        return found
+
+    # Store [(hash, scores)] for model_id
+    def put(self, scored, model_id):
+        with self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO scores VALUES (?, ?, {', '.join('?' * len(SCORE_COLUMNS))})",
+                [(hash, model_id, *map(float, scores)) for hash, scores in scored],
+            )
+
+    # Scores for texts in SCORE_COLUMNS order, only texts missing from the cache are passed to scorer.score
+    def score(self, texts, scorer):
+        hashes = [text_hash(text) for text in texts]
+        known = self.get(set(hashes), scorer.model_id)
+
+        # Each new text is scored once, however many times it appears
+        missing = {}
+        for hash, text in zip(hashes, texts):
+            if hash not in known:
+                missing.setdefault(hash, text)
+        if missing:
+            scores = scorer.score(list(missing.values()))
+            self.put(zip(missing, scores), scorer.model_id)
+            known.update(zip(missing, map(tuple, scores)))
+
+        self.misses += len(missing)
+        self.hits += len(hashes) - len(missing)
+        return np.array([known[hash] for hash in hashes], dtype=np.float64).reshape(-1, len(SCORE_COLUMNS))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,173 @@
+import sys, os
+scripts_folder = os.path.join(os.getcwd(), 'Scripts')
+sys.path.append(scripts_folder)
+import argparse
+import json
+import nltk
+import numpy as np
+import pandas as pd
+from nltk.sentiment.vader import SentimentIntensityAnalyzer as SIA
+from pathlib import Path
+from s3 import *
+from sentiment import MODEL, SCORE_COLUMNS, Scorer, sample_artifact_texts
+
+"""
+Lexicon-first sentiment: VADER scores every text, and only texts it isn't confident about go to RoBERTa.
+
+VADER's (neg, neu, pos, compound) are mapped onto RoBERTa's (neg, neu, pos) logits by a linear model fitted on
+texts scored by both, so texts that skip RoBERTa still get all of SCORE_COLUMNS on the same scale. A text is
+left to the lexicon if it's short (at most max_words words) and the softmax of its predicted logits puts at least
+threshold on one label. Each text's source ("lexicon" or "roberta") is returned alongside its scores.
+
+Calibration fits the linear model on a sample of artifact texts, then reports for a range of thresholds how many
+texts (and model tokens) would skip RoBERTa and how often they'd get the same label RoBERTa gives them.
+The lowest threshold reaching --target-agreement is saved with the model as the calibration file.
+
+USAGE:
+    python3 Scripts/sentiment_cascade.py calibrate processed/reddit/comments_artifacts/ [--rows 5000] [--target-agreement 0.9]
+    python3 Scripts/score_sentiment.py processed/reddit/comments_artifacts/ --cascade [calibration.json]
+"""
+
+CALIBRATION_PATH = Path(__file__).parent.parent / "SentimentAnalysis" / "cascade_calibration.json"
+# Longer texts always go to RoBERTa
+MAX_WORDS = 64
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98]
+LEXICON_COLUMNS = ["neg", "neu", "pos", "compound"]
+
+
+def vader():
+    try:
+        return SIA()
+    except LookupError:
+        nltk.download('vader_lexicon', quiet=True)
+        return SIA()
+
+
+# [n, 5] VADER scores plus a constant, the linear model's inputs
+def lexicon_features(analyser, texts):
+    features = np.ones((len(texts), len(LEXICON_COLUMNS) + 1))
+    for i, text in enumerate(texts):
+        scores = analyser.polarity_scores(text)
+        features[i, :len(LEXICON_COLUMNS)] = [scores[column] for column in LEXICON_COLUMNS]
+    return features
+
+
+def eligible(texts, max_words):
+    return np.array([0 < len(text.split()) <= max_words for text in texts])
+
+
+# Probability of the most likely label for each row of logits
+def confidence(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return (exp / exp.sum(axis=1, keepdims=True)).max(axis=1)
+
+
+# RoBERTa's (neg, neu, pos) logits from a score row
+def score_logits(scores):
+    return scores[:, [2, 1, 0]]
+
+
+# Score rows in SCORE_COLUMNS order from (neg, neu, pos) logits, combined the same way as Scorer.score
+def logits_scores(logits):
+    compound = logits[:, 2] - logits[:, 0]
+    return np.column_stack([logits[:, 2], logits[:, 1], logits[:, 0], compound, compound / np.sqrt(compound**2 + 20)])
+
+
+class Cascade:
+    def __init__(self, scorer, calibration_path=CALIBRATION_PATH, cache=None):
+        calibration = json.loads(Path(calibration_path).read_text())
+        if calibration["model_id"] != scorer.model_id:
+            raise Exception(f"{calibration_path} was calibrated for {calibration['model_id']}, not {scorer.model_id}")
+        self.scorer = scorer
+        self.cache = cache
+        self.weights = np.array(calibration["weights"])
+        self.threshold = calibration["threshold"]
+        self.max_words = calibration["max_words"]
+        self.analyser = vader()
+        # Identifies the checkpoints this produces
+        self.model_id = f"{scorer.model_id}:cascade{self.threshold}"
+
+    # Scores for texts in SCORE_COLUMNS order, and the source of each text's scores
+    def score_with_source(self, texts):
+        texts = list(texts)
+        logits = lexicon_features(self.analyser, texts) @ self.weights
+        confident = eligible(texts, self.max_words) & (confidence(logits) >= self.threshold)
+
+        scores = logits_scores(logits)
+        uncertain = [text for text, skip in zip(texts, confident) if not skip]
+        if uncertain:
+            scores[~confident] = self.cache.score(uncertain, self.scorer) if self.cache else self.scorer.score(uncertain)
+        return scores, np.where(confident, "lexicon", "roberta")
+
+    def score(self, texts):
+        return self.score_with_source(texts)[0]
+
+
+# Fit the lexicon -> RoBERTa model on a sample of texts, report the cascade's cost and agreement per threshold
+def calibrate(artifacts_prefix, scorer, rows=5000, max_words=MAX_WORDS, target_agreement=0.9, calibration_path=CALIBRATION_PATH):
+    texts = sample_artifact_texts(artifacts_prefix, rows)
+    print(f"Calibrating on {len(texts)} texts from {artifacts_prefix}")
+    features = lexicon_features(vader(), texts)
+    scores = scorer.score(texts)
+    tokens = np.array([len(ids) for ids in scorer.tokenizer(texts, add_special_tokens=False, verbose=False)["input_ids"]])
+
+    # Fit on short texts only, they're the only ones the lexicon can take
+    short = eligible(texts, max_words)
+    if not short.any():
+        raise Exception(f"No texts of at most {max_words} words to calibrate on")
+    weights = np.linalg.lstsq(features[short], score_logits(scores[short]), rcond=None)[0]
+
+    logits = features @ weights
+    lexicon_confidence = confidence(logits)
+    labels = np.argmax(logits, axis=1)
+    roberta_labels = np.argmax(score_logits(scores), axis=1)
+    compound = SCORE_COLUMNS.index("roberta_normalised_compound")
+    lexicon_compound = logits_scores(logits)[:, compound]
+
+    report = []
+    for threshold in THRESHOLDS:
+        skipped = short & (lexicon_confidence >= threshold)
+        report.append({
+            "threshold": threshold,
+            "lexicon share": skipped.mean(),
+            "tokens saved": tokens[skipped].sum() / max(tokens.sum(), 1),
+            "lexicon label agreement": (labels[skipped] == roberta_labels[skipped]).mean() if skipped.any() else np.nan,
+            "overall label agreement": np.mean(np.where(skipped, labels, roberta_labels) == roberta_labels),
+            "compound mean |delta|": np.abs(np.where(skipped, lexicon_compound, scores[:, compound]) - scores[:, compound]).mean(),
+        })
+    report = pd.DataFrame(report)
+    print(report.to_string(index=False, float_format="{:.3f}".format))
+
+    reached = report[report["lexicon label agreement"] >= target_agreement]
+    threshold = float(reached["threshold"].min()) if len(reached) else 1.0
+    print(f"Threshold {threshold}: lexicon label agreement >= {target_agreement}" if len(reached) else
+          f"No threshold reaches {target_agreement} agreement, saving threshold 1.0 (everything goes to RoBERTa)")
+
+    calibration_path = Path(calibration_path)
+    calibration_path.write_text(json.dumps({
+        "model_id": scorer.model_id,
+        "weights": weights.tolist(),
+        "threshold": threshold,
+        "max_words": max_words,
+        "target_agreement": target_agreement,
+        "calibrated_on": artifacts_prefix,
+        "rows": len(texts),
+        "report": json.loads(report.to_json(orient="records")),
+    }, indent=1))
+    print(f"Saved to {calibration_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the lexicon-first sentiment cascade")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    calibrate_parser = subparsers.add_parser("calibrate", help="Fit the lexicon model and pick a confidence threshold")
+    calibrate_parser.add_argument("prefix", help="S3 prefix of artifacts to sample texts from")
+    calibrate_parser.add_argument("--rows", type=int, default=5000)
+    calibrate_parser.add_argument("--max-words", type=int, default=MAX_WORDS)
+    calibrate_parser.add_argument("--target-agreement", type=float, default=0.9)
+    calibrate_parser.add_argument("--model", default=MODEL)
+    calibrate_parser.add_argument("--output", type=Path, default=CALIBRATION_PATH)
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        calibrate(args.prefix, Scorer(args.model), args.rows, args.max_words, args.target_agreement, args.output)
@@ -1,54 +1,69 @@
+import sys, os
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import *
-import sys, os
+from artifacts import *
 from tqdm import tqdm
 from pathlib import Path
+import pyarrow as pa
 import re
 
 """
 
 Split news files into artifacts based on which company is mentioned.
 
+By default only processed files that haven't been split yet are split, and their rows are merged into the
+existing ticker artifacts (see artifacts.py). Pass full to rebuild every artifact from all processed files (artifacts of tickers without rows are deleted).
+
 USAGE:
     python split_news.py
+    python split_news.py full
 
 """
 
+NEWS_SCHEMA = pa.schema([
+    ("url", pa.string()),
+    ("text", pa.string()),
+    ("domain", pa.string()),
+    ("dt", pa.int64()),
+])
+# Which processed files have been split, and which version of each
+LEDGER_PATH = "processed/news/gnews_split_ledger.json"
+
 # Uploaded zsts have a .jsonl at the end of the file name
 def remove_jsonl_suffix(path):
     jsonl_removed = str(path).replace(".jsonl", "")
     return jsonl_removed
 
-def split_news():
-    # Download all processed parquet files 
-    s3_paths = download_all("processed/news/gnews/")
-    output_path_artifacts = s3_to_local_path("processed/news/gnews_artifacts/")
+def split_news(full=False):
+    # Work out which processed parquet files are new
+    versions = {path: entry["etag"] for path, entry in refresh_manifest("processed/news/gnews/").items() if path.endswith(".parquet")}
+    ledger = {} if full else load_ledger(LEDGER_PATH)
+    s3_paths = pending_inputs(versions, ledger)
+    print(f"Splitting {len(s3_paths)} of {len(versions)} processed files")
+    if not s3_paths:
+        return
 
-    # Remove all existing files (technically not an issue since we dedupe but save spaces)
-    for path in output_path_artifacts.glob("*.csv"):
-        os.remove(path)
+    transfer_all(download, s3_paths)
+    output_path_artifacts = s3_to_local_path("processed/news/gnews_artifacts/")
+    output_path_artifacts.mkdir(exist_ok=True, parents=True)
 
-    # Hit them with the ol' Crunchertron 3000
-    for path in tqdm(s3_paths):
-        local_path = s3_to_local_path(path)
-        cmd = f"./Processing/cruncher/cruncher split-news {local_path} {output_path_artifacts}{os.sep}"
-        print(cmd)
-        os.system(cmd)
-        print(f"{path.split('/')[-1]} done.")    
+    # Remove any csvs left over from a failed run, they'd be merged in twice otherwise
+    clear_csvs(output_path_artifacts)
 
-    # Convert all the csvs
-    for path in tqdm(output_path_artifacts.glob("*.csv")):
-        df = pd.read_csv(path, names=["url", "text", "domain", "dt"])
-        df = df.drop_duplicates()
-        df.to_parquet(str(path).replace(".csv", ".parquet"))
+    # Hit them with the ol' Crunchertron 3000, one process for the whole batch
+    split_batch([("news", s3_to_local_path(path), output_path_artifacts) for path in s3_paths])
 
-    # Remove all csv files 
-    for path in output_path_artifacts.glob("*.csv"):
-        os.remove(path)
+    # Convert the csvs, merging into existing artifacts
+    touched = merge_artifacts("processed/news/gnews_artifacts/", NEWS_SCHEMA, merge=not full)
 
-    # Upload just the parquets
-    upload_all("processed/news/gnews_artifacts/")
+    # Upload just the touched parquets, then record the inputs as split
+    transfer_all(upload, touched)
+    # A full rebuild replaces every artifact, so drop tickers that no longer get any rows
+    if full:
+        remove_stale_artifacts("processed/news/gnews_artifacts/", touched)
+    ledger.update({path: versions[path] for path in s3_paths})
+    save_ledger(LEDGER_PATH, ledger)
 
 if __name__ == "__main__":
-    split_news()
+    split_news(full=len(sys.argv) > 1 and sys.argv[1] == "full")
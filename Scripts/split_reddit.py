@@ -1,68 +1,102 @@
+import sys, os
 scripts_folder = os.path.join(os.getcwd(), 'Scripts')
 sys.path.append(scripts_folder)
 from s3 import *
-import sys, os
+from artifacts import *
 from tqdm import tqdm
 from pathlib import Path
+import pyarrow as pa
 import re
 
 """
 
 Split reddit files into artifacts based on which company is mentioned.
 
+By default only subreddits whose processed submissions/comments haven't been split yet are split, and their
+rows are merged into the existing ticker artifacts (see artifacts.py). Pass full to rebuild every artifact (artifacts of tickers without rows are deleted).
+
 USAGE:
     python split_reddit.py
+    python split_reddit.py full
 
 """
 
+SUBMISSIONS_SCHEMA = pa.schema([
+    ("post_id", pa.string()),
+    ("text", pa.string()),
+    ("domain", pa.string()),
+    ("flair", pa.string()),
+    ("subreddit", pa.string()),
+    ("score", pa.int64()),
+    ("downs", pa.int64()),
+    ("datetime", pa.int64()),
+])
+COMMENTS_SCHEMA = pa.schema([
+    ("comment_id", pa.string()),
+    ("text", pa.string()),
+    ("score", pa.int64()),
+    ("datetime", pa.int64()),
+    ("parent_id", pa.string()),
+    ("start_ticker", pa.string()),
+    ("post_id", pa.string()),
+    ("flair", pa.string()),
+    ("subreddit", pa.string()),
+    ("post_score", pa.int64()),
+    ("post_downs", pa.int64()),
+    ("post_datetime", pa.int64()),
+])
+# Which processed submissions files have been split, and which version of each (plus its comments)
+LEDGER_PATH = "processed/reddit/split_ledger.json"
+
 # Uploaded zsts have a .jsonl at the end of the file name
 def remove_jsonl_suffix(path):
     jsonl_removed = str(path).replace(".jsonl", "")
     return jsonl_removed
 
-def split_reddit():
-    # Download all processed parquet files 
-    s3_submissions_paths = download_all("processed/reddit/submissions/")
-    s3_comments_paths = download_all("processed/reddit/comments/")
+# The cruncher finds a subreddit's comments file from its submissions path
+def comments_path(submissions_path):
+    return submissions_path.replace("submissions", "comments", 1)
+
+def split_reddit(full=False):
+    # Work out which subreddits are new, a subreddit changes if either of its files do
+    submissions = refresh_manifest("processed/reddit/submissions/")
+    comments = refresh_manifest("processed/reddit/comments/")
+    versions = {
+        path: entry["etag"] + "/" + comments[comments_path(path)]["etag"]
+        for path, entry in submissions.items()
+        if path.endswith(".parquet") and comments_path(path) in comments
+    }
+    ledger = {} if full else load_ledger(LEDGER_PATH)
+    s3_submissions_paths = pending_inputs(versions, ledger)
+    print(f"Splitting {len(s3_submissions_paths)} of {len(versions)} subreddits")
+    if not s3_submissions_paths:
+        return
+
+    transfer_all(download, s3_submissions_paths + [comments_path(path) for path in s3_submissions_paths])
     submissions_path_artifacts = s3_to_local_path("processed/reddit/submissions_artifacts/")
     comments_path_artifacts = s3_to_local_path("processed/reddit/comments_artifacts/")
     submissions_path_artifacts.mkdir(exist_ok=True, parents=True)
     comments_path_artifacts.mkdir(exist_ok=True, parents=True)
 
-    # Remove all existing files (technically not an issue since we dedupe but save spaces)
-    for path in submissions_path_artifacts.glob("*.csv"):
-        os.remove(path)
-    for path in comments_path_artifacts.glob("*.csv"):
-        os.remove(path) 
+    # Remove any csvs left over from a failed run, they'd be merged in twice otherwise
+    clear_csvs(submissions_path_artifacts)
+    clear_csvs(comments_path_artifacts)
             
-    # Hit them with the ol' Crunchertron 3000
-    for path in tqdm(s3_submissions_paths):
-        local_path = s3_to_local_path(path)
-        cmd = f"./Processing/cruncher/cruncher split-reddit {local_path} {submissions_path_artifacts}{os.sep}"
-        print(cmd)
-        os.system(cmd)
-        print(f"{path.split('/')[-1]} done.")    
-
-    # Convert all the csvs
-    for path in tqdm(submissions_path_artifacts.glob("*.csv")):
-        df = pd.read_csv(path, names="post_id,text,domain,flair,subreddit,score,downs,datetime".split(","))
-        df = df.drop_duplicates()
-        df.to_parquet(str(path).replace(".csv", ".parquet"))
-
-    for path in tqdm(comments_path_artifacts.glob("*.csv")):
-        df = pd.read_csv(path, names="comment_id,text,score,datetime,parent_id,start_ticker,post_id,flair,subreddit,post_score,post_downs,post_datetime".split(","))
-        df = df.drop_duplicates()
-        df.to_parquet(str(path).replace(".csv", ".parquet"))
+    # Hit them with the ol' Crunchertron 3000, one process for the whole batch
+    split_batch([("reddit", s3_to_local_path(path), submissions_path_artifacts) for path in s3_submissions_paths])
 
-    # Remove all csv files 
-    for path in submissions_path_artifacts.glob("*.csv"):
-        os.remove(path)
-    for path in comments_path_artifacts.glob("*.csv"):
-        os.remove(path) 
+    # Convert the csvs, merging into existing artifacts
+    touched = merge_artifacts("processed/reddit/submissions_artifacts/", SUBMISSIONS_SCHEMA, merge=not full)
+    touched += merge_artifacts("processed/reddit/comments_artifacts/", COMMENTS_SCHEMA, merge=not full)
 
-    # Upload just the parquets
-    upload_all("processed/reddit/submissions_artifacts/")
-    upload_all("processed/reddit/comments_artifacts/")
+    # Upload just the touched parquets, then record the inputs as split
+    transfer_all(upload, touched)
+    # A full rebuild replaces every artifact, so drop tickers that no longer get any rows
+    if full:
+        remove_stale_artifacts("processed/reddit/submissions_artifacts/", touched)
+        remove_stale_artifacts("processed/reddit/comments_artifacts/", touched)
+    ledger.update({path: versions[path] for path in s3_submissions_paths})
+    save_ledger(LEDGER_PATH, ledger)
 
 if __name__ == "__main__":
-    split_reddit()
+    split_reddit(full=len(sys.argv) > 1 and sys.argv[1] == "full")
@@ -0,0 +1,170 @@
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import ahocorasick
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pathlib import Path
+
+"""
+In-process ticker tagging, producing the same segments as TagText in the Go cruncher
+(Processing/cruncher/gnews_splitter.go) without shelling out or writing csvs.
+
+Search terms are compiled once into an Aho-Corasick automaton, so each text is scanned in a single pass
+rather than walking the trie from every start position. A match only counts if it starts at the beginning
+of the text or after one of START_PHRASE_CHARS, and ends at the end of the text or before one of
+END_PHRASE_CHARS, exactly as in the cruncher.
+
+    tagger = Tagger()
+    tagger.tag_text("Shares of Apple rose", start_ticker="")        # [("AAPL", "Shares of Apple rose")]
+    tagger.tag_array(pa.array([...]))                                # table of (row, ticker, text)
+
+USAGE:
+    python3 Scripts/tagger.py benchmark <processed_news.parquet>
+        Tag a processed news file with both this and `cruncher split-news`, compare the output and timings.
+"""
+
+REPO_PATH = Path(__file__).parent.parent.resolve()
+SEARCH_TERMS_PATH = REPO_PATH / "DataRetrieval" / "Stocks" / "data" / "search_terms_reduced.csv"
+CRUNCHER_DIR = REPO_PATH / "Processing" / "cruncher"
+
+# Chars that must precede a valid ticker name
+START_PHRASE_CHARS = " \t\n\"("
+# Chars that must follow a valid ticker name
+END_PHRASE_CHARS = " \t\n\"):?!."
+
+
+class Tagger:
+    def __init__(self, search_terms_path=SEARCH_TERMS_PATH):
+        self.automaton = ahocorasick.Automaton()
+        with open(search_terms_path, newline="") as f:
+            reader = csv.reader(f)
+            # Skip header
+            next(reader)
+            for ticker, terms in reader:
+                for term in terms.split("|"):
+                    # The cruncher's trie builder compares rune index against byte length, so terms with
+                    # non-ASCII characters never match there. Skip them so both produce the same tags.
+                    # If a term belongs to several tickers the last one wins, as in the cruncher.
+                    if term and term.isascii():
+                        self.automaton.add_word(term, (ticker, len(term)))
+        self.automaton.make_automaton()
+
+    # Valid (start, end, ticker) matches in a text, in the order the cruncher visits them
+    def matches(self, text):
+        last = len(text) - 1
+        found = []
+        for end, (ticker, length) in self.automaton.iter(text):
+            start = end - length + 1
+            if start > 0 and text[start - 1] not in START_PHRASE_CHARS:
+                continue
+            if end < last and text[end + 1] not in END_PHRASE_CHARS:
+                continue
+            found.append((start, end, ticker))
+        found.sort()
+        return found
+
+    # Split text into [(ticker, text)] segments, a new segment starts wherever a different ticker is mentioned
+    # Text before the first mention belongs to start_ticker, or to the first ticker mentioned if there isn't one
+    def tag_text(self, text, start_ticker=""):
+        output = []
+        current_ticker = start_ticker
+        segment_start = 0
+        for start, _, ticker in self.matches(text):
+            if current_ticker == "":
+                current_ticker = ticker
+            if current_ticker != ticker:
+                output.append((current_ticker, text[segment_start:start]))
+                current_ticker = ticker
+                segment_start = start
+        if segment_start < len(text):
+            output.append((current_ticker, text[segment_start:]))
+        return output
+
+    # Tag a batch of texts (Arrow string array or list), returns a table of (row, ticker, text) for
+    # every segment with a ticker, i.e. the rows the splitter would write, with row indexing into texts
+    def tag_array(self, texts, start_tickers=None):
+        texts = texts.to_pylist() if isinstance(texts, (pa.Array, pa.ChunkedArray)) else list(texts)
+        if start_tickers is None:
+            start_tickers = [""] * len(texts)
+        elif isinstance(start_tickers, (pa.Array, pa.ChunkedArray)):
+            start_tickers = start_tickers.to_pylist()
+
+        rows, tickers, segments = [], [], []
+        for row, (text, start_ticker) in enumerate(zip(texts, start_tickers)):
+            if text is None:
+                continue
+            for ticker, segment in self.tag_text(text, start_ticker or ""):
+                if ticker == "":
+                    continue
+                rows.append(row)
+                tickers.append(ticker)
+                segments.append(segment)
+        return pa.table({
+            "row": pa.array(rows, pa.int64()),
+            "ticker": pa.array(tickers, pa.string()),
+            "text": pa.array(segments, pa.string()),
+        })
+
+    # Tag record batches of processed news, yielding tables with the same columns as the news artifacts plus ticker
+    def tag_news(self, batches):
+        for batch in batches:
+            # Same text the cruncher tags, title then body, with "" for a missing one
+            text = pc.binary_join_element_wise(pc.fill_null(batch.column("title"), ""), pc.fill_null(batch.column("body"), ""), "\n")
+            tagged = self.tag_array(text)
+            rows = tagged.column("row")
+            yield pa.table({
+                "url": pc.take(batch.column("url"), rows),
+                "text": tagged.column("text"),
+                "domain": pc.take(batch.column("domain"), rows),
+                "dt": pc.take(batch.column("dt"), rows),
+                "ticker": tagged.column("ticker"),
+            })
+
+
+# Tag a processed news parquet with both taggers and compare (url, ticker, text) rows
+def benchmark(parquet_path, batch_size=1000):
+    parquet_path = Path(parquet_path).resolve()
+    parquet_file = pq.ParquetFile(parquet_path)
+    text_mb = sum(
+        pc.sum(pc.utf8_length(parquet_file.read_row_group(i, columns=[column]).column(column))).as_py() or 0
+        for i in range(parquet_file.num_row_groups) for column in ["title", "body"]
+    ) / 1024 / 1024
+
+    start = time.time()
+    tagger = Tagger()
+    build_seconds = time.time() - start
+    start = time.time()
+    python_rows = set()
+    for table in tagger.tag_news(parquet_file.iter_batches(batch_size=batch_size, columns=["url", "title", "body", "domain", "dt"])):
+        python_rows.update(zip(table.column("url").to_pylist(), table.column("ticker").to_pylist(), table.column("text").to_pylist()))
+    python_seconds = time.time() - start
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.time()
+        # The cruncher looks for the search terms relative to its own directory
+        subprocess.run(["./cruncher", "split-news", str(parquet_path), output_dir + os.sep], cwd=CRUNCHER_DIR, check=True)
+        cruncher_seconds = time.time() - start
+        cruncher_rows = set()
+        for csv_path in Path(output_dir).glob("*.csv"):
+            df = pd.read_csv(csv_path, names=["url", "text", "domain", "dt"], keep_default_na=False, dtype=str)
+            cruncher_rows.update(zip(df.url, [csv_path.stem] * len(df), df.text))
+
+    print(f"{parquet_file.metadata.num_rows} articles, {text_mb:.1f} MB of text")
+    print(f"{'':>10} {'seconds':>8} {'MB/s':>8} {'rows':>9}")
+    print(f"{'python':>10} {python_seconds:>8.2f} {text_mb / python_seconds:>8.1f} {len(python_rows):>9}   (+{build_seconds:.2f}s to build automaton)")
+    print(f"{'cruncher':>10} {cruncher_seconds:>8.2f} {text_mb / cruncher_seconds:>8.1f} {len(cruncher_rows):>9}   (includes process start, trie build and csv writing)")
+    print(f"Rows in both: {len(python_rows & cruncher_rows)}, only python: {len(python_rows - cruncher_rows)}, only cruncher: {len(cruncher_rows - python_rows)}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "benchmark":
+        benchmark(sys.argv[2])
+    else:
+        print("Usage: python3 Scripts/tagger.py benchmark <processed_news.parquet>")
+        sys.exit(1)
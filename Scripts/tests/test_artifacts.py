@@ -0,0 +1,70 @@
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import csv
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+import pyarrow as pa
+import pyarrow.parquet as pq
+import artifacts
+from artifacts import Deduper, convert_artifact
+
+"""
+Row deduplication across the record batches of a ticker artifact, and streaming ticker csvs into parquet.
+
+USAGE:
+    python3 -m unittest discover Scripts/tests
+"""
+
+SCHEMA = pa.schema([("text", pa.string()), ("score", pa.int64())])
+
+
+def batch(rows):
+    return pa.RecordBatch.from_pylist([dict(zip(SCHEMA.names, row)) for row in rows], schema=SCHEMA)
+
+
+class DeduperTest(unittest.TestCase):
+    def test_duplicates_within_a_batch(self):
+        dedupe = Deduper()
+        self.assertEqual(dedupe(batch([("a", 5), ("a", 5), ("b", 5)])).num_rows, 2)
+
+    # An int column with a null becomes floats in pandas, the same row must still hash the same
+    def test_duplicate_after_batch_with_null(self):
+        dedupe = Deduper()
+        self.assertEqual(dedupe(batch([("a", 5), ("b", None)])).num_rows, 2)
+        self.assertEqual(dedupe(batch([("a", 5), ("c", 1)])).to_pylist(), [{"text": "c", "score": 1}])
+
+    def test_null_differs_from_empty_and_zero(self):
+        dedupe = Deduper()
+        self.assertEqual(dedupe(batch([(None, 0), ("", 0), ("", None), (None, None)])).num_rows, 4)
+
+    # Enough batches of varied sizes for the seen hashes to go through several merges
+    def test_matches_set_over_many_batches(self):
+        dedupe, seen, kept = Deduper(), set(), []
+        for i in range(60):
+            rows = [(str((i * 37 + j) % 500), j % 3) for j in range(i % 7 * 11 + 1)]
+            kept += dedupe(batch(rows)).to_pylist()
+            for row in rows:
+                seen.add(row)
+        self.assertEqual(len(kept), len(seen))
+        self.assertEqual({(row["text"], row["score"]) for row in kept}, seen)
+
+
+class ConvertArtifactTest(unittest.TestCase):
+    # Quoted newlines in text must parse even when they fall across a csv block boundary
+    def test_newlines_across_blocks(self):
+        rows = [(f"line one {i}\nline two\n\nline four", i) for i in range(200)] + [("line one 0\nline two\n\nline four", 0)]
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path, parquet_path = Path(directory) / "T.csv", Path(directory) / "T.parquet"
+            with open(csv_path, "w", newline="") as f:
+                csv.writer(f).writerows(rows)
+            # A few rows per block, so plenty of blocks start or end inside a quoted text
+            with mock.patch.object(artifacts, "CSV_BLOCK_SIZE", 97):
+                written = convert_artifact(csv_path, parquet_path, SCHEMA)
+            self.assertEqual(written, 200)
+            self.assertEqual(pq.read_table(parquet_path).to_pylist(), [{"text": text, "score": score} for text, score in rows[:200]])
+
+
+if __name__ == "__main__":
+    unittest.main()
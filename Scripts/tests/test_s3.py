@@ -0,0 +1,76 @@
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError
+import s3
+
+"""
+Upload retries, against a mocked S3 client so no bucket or credentials are needed.
+
+USAGE:
+    python3 -m unittest discover Scripts/tests
+"""
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "PutObject")
+
+
+# upload_file raises S3UploadFailedError with the ClientError as its context, like boto3 does
+def upload_failed(code):
+    try:
+        raise client_error(code)
+    except ClientError as e:
+        try:
+            raise S3UploadFailedError(f"Failed to upload: {e}")
+        except S3UploadFailedError as upload_error:
+            return upload_error
+
+
+class UploadRetryTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = Path(directory.name)
+        for name, value in [("LOCAL_PATH", root / "local"), ("CACHE_DB_PATH", root / "cache.sqlite"), ("TRANSFER_BACKOFF", 0)]:
+            patcher = mock.patch.object(s3, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = mock.MagicMock()
+        # with_retries logs the name of the call it retries
+        self.client.upload_file.__name__ = "upload_file"
+        patcher = mock.patch.object(s3, "s3", self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.s3_path = "processed/test/file.parquet"
+        local_path = s3.s3_to_local_path(self.s3_path)
+        local_path.parent.mkdir(parents=True)
+        local_path.write_bytes(b"data")
+
+    def test_failed_upload_is_retried(self):
+        self.client.upload_file.side_effect = [upload_failed("500"), None]
+        with s3.UploadQueue(workers=1) as uploads:
+            uploads.put(self.s3_path)
+        self.assertEqual(uploads.failed, [])
+        self.assertEqual(self.client.upload_file.call_count, 2)
+
+    def test_permission_error_is_not_retried(self):
+        self.client.upload_file.side_effect = upload_failed("AccessDenied")
+        with s3.UploadQueue(workers=1) as uploads:
+            uploads.put(self.s3_path)
+        self.assertEqual(uploads.failed, [self.s3_path])
+        self.assertEqual(self.client.upload_file.call_count, 1)
+
+    def test_upload_all_retries(self):
+        self.client.upload_file.side_effect = [upload_failed("SlowDown"), upload_failed("500"), None]
+        s3.upload_all("processed/test/")
+        self.assertEqual(self.client.upload_file.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()